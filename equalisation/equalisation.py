@@ -251,12 +251,14 @@ def threshold_scan(From, to, step, spacing, time, count, df, th_count):
 #              - tp1_thl: if True, calculate output threshold value based on a method used in the equalisation procedure
 #                     for Timepix1, which increased or decreases the threshold based on detector polarity and 
 #                     the standard deviation of the procedure threshold distribution; default False
+#              - mask_file: if given, save the final pixel mask to this ".npy" file; it can be passed to
+#                     "file_to_df()" in the simulation code (argument "mask") to drop hits on masked pixels
 #              
 #   RETURNS:   - dac_thl: new, optimised global threshold.
 #              - mask_list: list containing pixel masking information (0: disabled/masked; 1: enabled/not masked)
 #              - adj_list: list containing optimised pixel adjustment bits (0-15)
 
-def equalise(From, to, step, spacing=4, time=1e-3, count=1, autorange=False, timepix_mode=0, thl_coarse=False, th_count=5, polarity=1, return_df=False, save=False, x_space=1, y_space=1, tp1_thl=False):
+def equalise(From, to, step, spacing=4, time=1e-3, count=1, autorange=False, timepix_mode=0, thl_coarse=False, th_count=5, polarity=1, return_df=False, save=False, x_space=1, y_space=1, tp1_thl=False, mask_file=None):
      
     print('-------------------------------------------------------------------------')    
         
@@ -372,6 +374,11 @@ def equalise(From, to, step, spacing=4, time=1e-3, count=1, autorange=False, tim
         dac_thl+=polarity * std_opt * 15 
      
 
+    ## SAVE MASK LIST (if wanted)
+    if mask_file is not None:
+        np.save(mask_file, df['mask_final'].to_numpy(dtype='int'))
+    
+    
     ## VISUALISE RESULTS (and save figure, if wanted)
     print('[{0}] Visualising results. \n'.format(datetime.now()))
     visualise(From, to, step,df, save)
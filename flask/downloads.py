@@ -0,0 +1,98 @@
+#  -------------------------------------------------------------------------------------
+#  "downloads.py" - Contains functions to build zip archives for downloads from the Flask GUI
+#  -------------------------------------------------------------------------------------
+#
+#  Two kinds of zip archives are downloaded from the GUI:
+#         - the python code (the "timepix3" package), which only changes when the code changes:
+#           "build_archive()" builds it once in memory; "source_signature()" tells whether the
+#           files have changed since, so that the archive is only rebuilt when necessary
+#         - simulated data sets, which can be large: "stream_zip()" generates the archive piece
+#           by piece while it is sent, so that the download starts at once and no zip file is
+#           written to disk first
+#
+#
+#  This file only requires modules of the python standard library.
+
+
+# import modules
+import io
+import os
+import zipfile
+
+
+# files in a directory (without python byte code): list of (path, name in the archive)
+
+def archive_files(directory):
+
+    files=[]
+    for root, dirs, names in os.walk(directory):
+        dirs[:]=sorted(d for d in dirs if d!='__pycache__')
+        for name in sorted(names):
+            path=os.path.join(root, name)
+            files.append((path, os.path.relpath(path, directory)))
+
+    return files
+
+
+# signature of the files in a directory (names, sizes and modification times), which changes
+# whenever a file is added, deleted or modified
+
+def source_signature(directory):
+
+    signature=[]
+    for path, name in archive_files(directory):
+        stat=os.stat(path)
+        signature.append((name, stat.st_size, stat.st_mtime_ns))
+
+    return tuple(signature)
+
+
+# zip archive of the files in a directory, built in memory (returns the bytes of the archive)
+
+def build_archive(directory):
+
+    buffer=io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for path, name in archive_files(directory):
+            archive.write(path, name)
+
+    return buffer.getvalue()
+
+
+# write-only file object which collects the data written to it until it is taken out with "pop()"
+class ChunkBuffer:
+
+    def __init__(self):
+        self.chunks=[]
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+# generate a zip archive of the files in a directory piece by piece:
+#    (generator of bytes; files are read and compressed in blocks of "block_size" bytes)
+
+def stream_zip(directory, block_size=2**20):
+
+    buffer=ChunkBuffer()
+
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for path, name in archive_files(directory):
+            info=zipfile.ZipInfo.from_file(path, name)
+            info.compress_type=zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as src, archive.open(info, 'w', force_zip64=True) as dst:
+                for block in iter(lambda: src.read(block_size), b''):
+                    dst.write(block)
+                    yield from buffer.pop()
+            yield from buffer.pop()
+
+    # central directory, written when the archive is closed
+    yield from buffer.pop()
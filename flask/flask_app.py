@@ -16,25 +16,86 @@
 #  in the GUI until the server has been re-started by re-executing this file.
 #
 #
-#  Numpy and Flask are required, as well as the functions "simulate()" and "visualise()" which
-#  are defined in "generate.py".
+#  Simulations and visualisations run as background jobs in a pool of worker processes (see 
+#  "jobs.py"): submitting a form redirects to a status page of the job ("/jobs/<job id>"), from 
+#  which the output can be downloaded once the job is done. The number of worker processes and the
+#  maximum number of unfinished jobs are set by the environment variables TIMEPIX3_JOB_WORKERS 
+#  (default: 2) and TIMEPIX3_MAX_JOBS (default: 16). Every job writes its files into its own
+#  temporary directory (created in TIMEPIX3_JOB_DIR, default: the system temp directory), so that
+#  requests of several users can be served at once; directories of finished jobs are deleted after
+#  TIMEPIX3_JOB_TTL seconds (default: 3600). The state of each job is stored in its directory, so
+#  that the app can also be served by several processes on one machine (e.g. the workers of a WSGI
+#  server, sharing TIMEPIX3_JOB_DIR and TIMEPIX3_CACHE_DIR): each of them can report on, return
+#  and cancel every job; the numbers of worker processes and jobs apply to each process.
+#
+#
+#  Simulated data sets with a given seed are kept in a disk cache (see "results.py"; directory 
+#  TIMEPIX3_CACHE_DIR, default: "output/cache"; at most TIMEPIX3_CACHE_BYTES bytes, default: 1 GiB),
+#  so that requests for the same data set are answered at once. Data sets of finished jobs are
+#  zipped while they are downloaded (see "stream_zip()" in "downloads.py"), so that the download 
+#  starts at once and no copy of the data set is written to disk.
+#
+#
+#  The zip file of the python code ("/code") is built in memory when the server starts and rebuilt
+#  only when the code changes; it is sent with an ETag, so that browsers which already have the 
+#  current version receive a "304 Not Modified" response instead.
+#
+#
+#  Flask is required, as well as the functions "simulate()" and "visualise()" which are defined 
+#  in "generate.py".
 #
 #
 #                                                                    David Amorim, 2022
 
 
 # import relevant modules
-from flask import Flask, render_template, request, send_file
-from timepix3.generate import simulate, visualise
+from flask import Flask, Response, render_template, request, send_file, redirect, url_for, jsonify, abort
+from jobs import JobQueue, QueueFull, simulation_job, visualisation_job
+from results import code_version, result_file, lookup_result, cache_lock, pending_job, set_pending
+from downloads import source_signature, build_archive, stream_zip
 from werkzeug.utils import secure_filename
-import shutil
-import numpy as np
+import hashlib
+import atexit
+import io
 import os
 
 
 # initiate Flask application
 app = Flask(__name__)
 
+# background jobs: number of worker processes, maximum number of unfinished jobs, directory for the 
+# job directories (default: system temp directory) and time in seconds for which results are kept
+app.config['JOB_WORKERS']=int(os.environ.get('TIMEPIX3_JOB_WORKERS', 2))
+app.config['MAX_JOBS']=int(os.environ.get('TIMEPIX3_MAX_JOBS', 16))
+app.config['JOB_DIR']=os.environ.get('TIMEPIX3_JOB_DIR')
+app.config['JOB_TTL']=float(os.environ.get('TIMEPIX3_JOB_TTL', 3600))
+queue=JobQueue(app.config['JOB_WORKERS'], app.config['MAX_JOBS'], app.config['JOB_DIR'], app.config['JOB_TTL'])
+
+# delete the directories of the jobs of this process when the server is shut down
+atexit.register(queue.shutdown)
+
+# cache of simulated data sets: directory, maximum size in bytes and version of the code (see "results.py")
+app.config['CACHE_DIR']=os.environ.get('TIMEPIX3_CACHE_DIR', os.path.join('output', 'cache'))
+app.config['CACHE_BYTES']=int(os.environ.get('TIMEPIX3_CACHE_BYTES', 2**30))
+version=code_version()
+
+# zip file of the python code: built at start-up and rebuilt when the source files change
+code_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'timepix3')
+code_archive={'signature': None, 'data': None, 'etag': None}
+
+
+def update_code_archive():
+
+    signature=source_signature(code_dir)
+    if signature!=code_archive['signature']:
+        data=build_archive(code_dir)
+        code_archive.update(signature=signature, data=data, etag=hashlib.sha256(data).hexdigest())
+
+    return code_archive
+
+
+update_code_archive()
+
 
 # set up home page at "http://localhost:5000" based on the template "index.html":
 
@@ -51,47 +112,74 @@ def print_info():
    return render_template('read_me.html')
 
 
-# zip up the python code files and download; triggered by visiting "http://localhost:5000/code"
-# which is linked on the starting page
+# download the zipped python code files; triggered by visiting "http://localhost:5000/code" which is
+# linked on the starting page (answered with "304 Not Modified" if the ETag sent by the browser in 
+# "If-None-Match" matches the current archive)
 
 @app.route('/code')
 def download_code():
 
-    # zip code files
-    shutil.make_archive('./output/timepix3', 'zip', './timepix3')
+    archive=update_code_archive()
 
-    # download zip file
-    filename= os.path.join('output', 'timepix3.zip')
-    return send_file(filename, as_attachment=True)
+    return send_file(io.BytesIO(archive['data']), mimetype='application/zip', as_attachment=True, 
+                     download_name='timepix3.zip', etag=archive['etag'])
 
-# generate simulated data based on form input, zip up output files and download;
-# triggered by filling in the input forms on the starting page and pressing the
-# "submit" button
+
+# generate simulated data based on form input as a background job (see "jobs.py") and redirect to 
+# the status page of the job, from which the zipped output files can be downloaded; triggered by 
+# filling in the input forms on the starting page and pressing the "submit" button
 
 @app.route('/processing', methods=['POST'])
 def processing():
 
-    # read form input
+    # read form input (no seed: random seed, data set is not cached)
     N=int(request.form['hits'])
     op_mode=int(request.form['op_mode'])
+    seed=request.form.get('seed', '').strip()
+    seed=int(seed) if seed else None
 
-    # generate data
-    simulate(N, op_mode)
+    # no seed: submit job (output is written to the job's own directory)
+    if seed is None:
+        return submit_simulation(N, op_mode, seed, None)
 
-    # zip output files
-    if not os.path.exists('./output/data'):
-        os.mkdir('./output/data')
-    shutil.move('packets.bin','./output/data/packets.bin')
-    shutil.move('values.csv','./output/data/values.csv')
-    shutil.make_archive('./output/sim_data','zip','./output/data' )
+    # return data set from the cache if the same simulation has been run before, or redirect to the 
+    # job that is generating it (under a lock, so that server processes never start the same job twice)
+    cache_file=result_file(app.config['CACHE_DIR'], N, op_mode, seed, version)
+    with cache_lock(app.config['CACHE_DIR']):
+        cached=lookup_result(cache_file)
+        if cached is None:
+            job_id=pending_job(cache_file)
+            try:
+                running=queue.state(job_id) in ['queued', 'running']
+            except KeyError:              # no job, or job already deleted
+                running=False
+            if not running:
+                return submit_simulation(N, op_mode, seed, cache_file)
+            return redirect(url_for('job_page', job_id=job_id), code=303)
 
-    # download files
-    filename= os.path.join('output', 'sim_data.zip')
-    return send_file(filename, as_attachment=True)
+    return send_file(cached, mimetype='application/zip', as_attachment=True, download_name='sim_data.zip')
+
+
+# submit a simulation job and redirect to its status page (the job is recorded as generating the cache 
+# entry "cache_file", if given)
+
+def submit_simulation(N, op_mode, seed, cache_file):
+
+    job_id, directory=queue.create()
+    try:
+        queue.submit(job_id, simulation_job, N, op_mode, directory, seed, cache_file, app.config['CACHE_BYTES'])
+    except QueueFull as error:
+        return str(error), 503
+
+    if cache_file is not None:
+        set_pending(cache_file, job_id)
+
+    return redirect(url_for('job_page', job_id=job_id), code=303)
 
 
-# read in a csv file with input data and return (automatically download) an animated GIF;
-# triggered by filling in the input form on the starting page and pressing "submit"
+# read in a file with input data (csv, binary packets or cache file, see "hit_columns()" in "generate.py") 
+# and create an animated GIF as a background job; triggered by filling in the input form on the 
+# starting page and pressing "submit"
 
 @app.route('/visualising', methods=['POST'])
 def visualising():
@@ -99,17 +187,73 @@ def visualising():
     # read form input
     steps=int(request.form['frames'])
     input_file=request.files['in_file']
-    if not os.path.exists('./input'):
-        os.mkdir('./input')
-    in_file=os.path.join('input', secure_filename(input_file.filename))
+
+    # save input file in the job's own directory
+    job_id, directory=queue.create()
+    in_file=os.path.join(directory, secure_filename(input_file.filename))
     input_file.save(in_file)
 
-    # create visualisation
-    visualise(steps)
-    out_file=os.path.join('output', 'timepix_simulations.gif')
+    # submit job
+    try:
+        queue.submit(job_id, visualisation_job, steps, in_file, directory)
+    except QueueFull as error:
+        return str(error), 503
+
+    return redirect(url_for('job_page', job_id=job_id), code=303)
+
+
+# status page of a job (refreshes itself until the job has finished)
+
+@app.route('/jobs/<job_id>')
+def job_page(job_id):
+
+    if not queue.exists(job_id):
+        abort(404)
+
+    return render_template('processing.html', job=queue.status(job_id))
+
+
+# state of a job as JSON: {'id': ..., 'state': 'queued'/'running'/'done'/'failed'/'cancelled', 'error': ...}
+
+@app.route('/jobs/<job_id>/status')
+def job_status(job_id):
+
+    if not queue.exists(job_id):
+        abort(404)
+
+    return jsonify(queue.status(job_id))
+
+
+# download the output of a finished job (a directory of output files is zipped while it is sent)
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+
+    if not queue.exists(job_id):
+        abort(404)
+
+    filename=queue.result(job_id)
+    if filename is None:
+        return 'job {0} is {1}'.format(job_id, queue.state(job_id)), 409
+
+    if os.path.isdir(filename):
+        return Response(stream_zip(filename), mimetype='application/zip', 
+                        headers={'Content-Disposition': 'attachment; filename=sim_data.zip'})
+
+    return send_file(filename, as_attachment=True)
+
+
+# cancel a job
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+
+    if not queue.exists(job_id):
+        abort(404)
+
+    queue.cancel(job_id)
 
-    # download file
-    return send_file(out_file, as_attachment=True)
+    return redirect(url_for('job_page', job_id=job_id), code=303)
 
 
 # run Flask app when python file is executed:
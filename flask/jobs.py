@@ -0,0 +1,355 @@
+#  -------------------------------------------------------------------------------------
+#  "jobs.py" - Contains a queue of background jobs for the Flask GUI
+#  -------------------------------------------------------------------------------------
+#
+#  Generating or visualising large data sets takes much longer than a browser waits for a
+#  response. Instead of doing the work inside the request, the Flask app submits it as a job to
+#  a "JobQueue": the job runs in a bounded pool of worker processes and the request returns
+#  immediately with the id of the job. The state of the job ('queued', 'running', 'done',
+#  'failed' or 'cancelled') can then be polled and its result (the path of the output file, or of
+#  the directory of output files) downloaded once it is done.
+#
+#
+#  The number of worker processes ("workers") limits how many jobs run at once; the number of
+#  unfinished jobs ("max_jobs") is limited as well, so that new jobs are refused rather than
+#  queued without bound. Queued jobs can be cancelled; a job that is already running cannot be
+#  stopped, but its result is discarded.
+#
+#
+#  Every job has its own directory ("create()"), so that jobs of different users never read or
+#  write the same files. The job functions "simulation_job()" and "visualisation_job()" wrap
+#  "simulate()" and "visualise()" in "generate.py" and write all output files into that directory.
+#  The output files of a cancelled job are deleted once it is no longer running; directories are
+#  deleted when a finished job is older than "ttl" seconds ("expire()", called whenever a job is
+#  created) and, for the jobs submitted by the queue, when the queue is shut down.
+#
+#
+#  The state of a job is kept in the file "job.json" in its directory (written atomically by the
+#  worker process running the job) rather than in the memory of the process that submitted it.
+#  Several processes serving the GUI on one machine (e.g. the workers of a WSGI server) can share
+#  the directory "root" of the job directories: any of them can report the state of a job, return
+#  its result or cancel it while it is queued or running (a cancelled job is marked by the file
+#  "cancelled" in its directory). Each process runs the jobs it submitted in its own pool of worker
+#  processes, so "workers" and "max_jobs" apply per process. Jobs of a process that has stopped
+#  before they finished are reported as failed.
+#
+#
+#  This file requires the functions "simulate()" and "visualise()" in "generate.py" and
+#  "store_result()" in "results.py".
+
+
+# import modules
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from timepix3.generate import simulate, visualise
+from results import store_result
+
+
+# raised when a job is submitted to a queue which already holds "max_jobs" unfinished jobs
+class QueueFull(Exception):
+    pass
+
+
+# directory of a job (KeyError for malformed job ids, so that ids never point outside of "root")
+
+def job_directory(root, job_id):
+
+    if not re.fullmatch('[0-9a-f]{32}', str(job_id)):
+        raise KeyError(job_id)
+
+    return os.path.join(root, 'timepix3-{0}'.format(job_id))
+
+
+# state file of a job: read (None if there is none) and update (written to a temporary file first,
+# so that other processes never read a partially written state)
+
+def read_state(directory):
+
+    try:
+        with open(os.path.join(directory, 'job.json')) as dfile:
+            return json.load(dfile)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_state(directory, **info):
+
+    state=read_state(directory) or {}
+    state.update(info)
+
+    tmp=os.path.join(directory, 'job.json.{0}.tmp'.format(os.getpid()))
+    with open(tmp, 'w') as dfile:
+        json.dump(state, dfile)
+    os.replace(tmp, os.path.join(directory, 'job.json'))
+
+    return state
+
+
+# delete the output files of a job (the state files are kept)
+
+def clear_outputs(directory):
+
+    for name in os.listdir(directory):
+        if name in ['job.json', 'cancelled']:
+            continue
+        path=os.path.join(directory, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# True if the process "pid" is still running
+
+def process_alive(pid):
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+# run "func(*args)" as the job in "directory" (executed in a worker process) and record its state
+#    (jobs cancelled before they start are not run; output of jobs cancelled while running is deleted)
+
+def run_job(directory, func, *args):
+
+    if os.path.exists(os.path.join(directory, 'cancelled')):
+        write_state(directory, state='cancelled', finished=time.time())
+        return None
+
+    write_state(directory, state='running')
+
+    try:
+        result=func(*args)
+    except Exception as error:
+        write_state(directory, state='failed', error=str(error), finished=time.time())
+        raise
+
+    if os.path.exists(os.path.join(directory, 'cancelled')):
+        clear_outputs(directory)
+        write_state(directory, state='cancelled', finished=time.time())
+        return None
+
+    write_state(directory, state='done', result=result, finished=time.time())
+
+    return result
+
+
+class JobQueue:
+
+    def __init__(self, workers=2, max_jobs=16, root=None, ttl=3600):
+
+        self.pool=ProcessPoolExecutor(max_workers=workers)
+        self.max_jobs=max_jobs
+        self.root=tempfile.gettempdir() if root is None else root    # directory for the job directories
+        self.ttl=ttl              # time in seconds after which finished jobs are deleted
+        self.jobs={}              # job id -> future of the jobs submitted by this queue
+        self.lock=threading.Lock()
+
+    # create a new job: returns its id and its own directory (the job is run with "submit()")
+    def create(self):
+
+        self.expire()
+
+        job_id=uuid.uuid4().hex
+        directory=job_directory(self.root, job_id)
+        os.makedirs(self.root, exist_ok=True)
+        os.mkdir(directory, 0o700)
+
+        return job_id, directory
+
+    # True if the job exists (in this or any other process sharing "root")
+    def exists(self, job_id):
+
+        try:
+            return read_state(job_directory(self.root, job_id)) is not None
+        except KeyError:
+            return False
+
+    # delete a job and its directory (the job must not be running)
+    def remove(self, job_id):
+
+        with self.lock:
+            self.jobs.pop(job_id, None)
+
+        shutil.rmtree(job_directory(self.root, job_id), ignore_errors=True)
+
+    # delete jobs which finished more than "ttl" seconds ago
+    #    (jobs which were never submitted or whose server process has stopped count as finished
+    #     when their directory or state was last modified)
+    def expire(self):
+
+        now=time.time()
+        try:
+            names=os.listdir(self.root)
+        except FileNotFoundError:
+            return
+
+        for name in names:
+            if not name.startswith('timepix3-'):
+                continue
+            job_id=name[len('timepix3-'):]
+            try:
+                directory=job_directory(self.root, job_id)
+                state=read_state(directory)
+                if state is None:
+                    finished=os.path.getmtime(directory)
+                elif state.get('finished') is not None:
+                    finished=state['finished']
+                elif not process_alive(state['pid']):
+                    finished=os.path.getmtime(os.path.join(directory, 'job.json'))
+                else:
+                    continue
+            except (KeyError, FileNotFoundError):
+                continue
+            if now - finished > self.ttl:
+                self.remove(job_id)
+
+    # number of jobs submitted by this queue that are queued or running
+    def unfinished(self):
+        return sum(not future.done() for future in self.jobs.values())
+
+    # run "func(*args)" in a worker process as the job "job_id"
+    def submit(self, job_id, func, *args):
+
+        directory=job_directory(self.root, job_id)
+
+        with self.lock:
+            full=self.unfinished() >= self.max_jobs
+            if not full:
+                write_state(directory, id=job_id, state='queued', error=None, result=None, finished=None, pid=os.getpid())
+                self.jobs[job_id]=self.pool.submit(run_job, directory, func, *args)
+                self.jobs[job_id].add_done_callback(lambda future: self.job_finished(job_id, future))
+
+        # job is not run: delete its directory
+        if full:
+            self.remove(job_id)
+            raise QueueFull('too many jobs in the queue, try again later')
+
+        return job_id
+
+    # record jobs which ended without "run_job()" recording it (e.g. a worker process was killed)
+    def job_finished(self, job_id, future):
+
+        directory=job_directory(self.root, job_id)
+        state=read_state(directory)
+        if (state is None) or (state['state'] not in ['queued', 'running']):
+            return
+
+        if future.cancelled():
+            write_state(directory, state='cancelled', finished=time.time())
+        else:
+            write_state(directory, state='failed', error=str(future.exception()), finished=time.time())
+
+    # state of a job: 'queued', 'running', 'done', 'failed' or 'cancelled' (KeyError for unknown jobs)
+    def state(self, job_id):
+
+        return self.status(job_id)['state']
+
+    # state of a job and, for failed jobs, the error message
+    def status(self, job_id):
+
+        directory=job_directory(self.root, job_id)
+        state=read_state(directory)
+        if state is None:
+            raise KeyError(job_id)
+
+        status={'id': job_id, 'state': state['state'], 'error': state.get('error')}
+
+        if os.path.exists(os.path.join(directory, 'cancelled')):
+            status.update(state='cancelled', error=None)
+        elif (status['state'] in ['queued', 'running']) and (not process_alive(state['pid'])):
+            status.update(state='failed', error='the server process running the job has stopped')
+
+        return status
+
+    # result of a finished job (None unless the job is done)
+    def result(self, job_id):
+
+        if self.state(job_id)!='done':
+            return None
+
+        return read_state(job_directory(self.root, job_id))['result']
+
+    # cancel a job: returns True if the job was stopped before it started running; running jobs
+    # finish, but are reported as cancelled and their result is not returned
+    #    (the output files of the job are deleted as soon as the job is no longer running; jobs which
+    #     are already done, failed or cancelled are left unchanged and False is returned)
+    def cancel(self, job_id):
+
+        directory=job_directory(self.root, job_id)
+        if self.state(job_id) not in ['queued', 'running']:
+            return False
+
+        marker=os.path.join(directory, 'cancelled')
+        open(marker, 'w').close()
+
+        # job finished in the meantime: keep its result
+        state=read_state(directory)
+        if state['state'] in ['done', 'failed']:
+            os.remove(marker)
+            return False
+
+        future=self.jobs.get(job_id)
+        stopped=(future is not None) and future.cancel()
+
+        # job will not run: delete its output now (otherwise "run_job()" does)
+        if stopped:
+            clear_outputs(directory)
+            write_state(directory, state='cancelled', finished=time.time())
+
+        return stopped
+
+    # wait for running jobs, stop the worker processes and delete the directories of the jobs
+    # submitted by this queue
+    def shutdown(self):
+
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+        for job_id in list(self.jobs):
+            self.remove(job_id)
+
+
+# generate simulated data (see "simulate()") in "directory":
+#    (returns the path of the directory of output files, which is zipped while it is downloaded; if 
+#     "cache_file" is given, the zipped files are also stored there, in a cache of at most "max_bytes", 
+#     see "results.py")
+
+def simulation_job(N, op_mode, directory, seed=None, cache_file=None, max_bytes=2**30):
+
+    data=os.path.join(directory, 'data')
+    os.makedirs(data, exist_ok=True)
+
+    simulate(N, op_mode, os.path.join(data, 'packets.bin'), os.path.join(data, 'values.csv'), seed=seed)
+
+    if cache_file is not None:
+        store_result(data, cache_file, max_bytes)
+
+    return data
+
+
+# animate hit data in "in_file" (see "visualise()"):
+#    (returns the path of the animated GIF)
+
+def visualisation_job(steps, in_file, directory):
+
+    out_file=os.path.join(directory, 'timepix_simulations.gif')
+
+    visualise(steps, in_file, out_file)
+
+    return out_file
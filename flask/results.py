@@ -0,0 +1,137 @@
+#  -------------------------------------------------------------------------------------
+#  "results.py" - Contains a disk cache of simulated data sets for the Flask GUI
+#  -------------------------------------------------------------------------------------
+#
+#  Simulations with a given seed are reproducible (see "simulate()" in "generate.py"), so a data
+#  set requested with the same parameters as an earlier one does not need to be generated again.
+#  The zip files of simulated data are stored in a cache directory, keyed by the parameters of the
+#  simulation (N, op_mode, seed, shard size) and the version of the code: a hash of the source
+#  files of the "timepix3" package, so that changes to the generator (e.g. its simulation
+#  parameters) never return stale data.
+#
+#
+#  The total size of the cache is bounded ("max_bytes"): whenever a new data set is stored, the
+#  least recently used ones are deleted (see "evict()" in "cache.py"). Data sets are zipped into a
+#  temporary file first, so that other processes never read a partially written entry.
+#
+#
+#  While a data set is generated, the id of the job generating it is kept next to the cache entry
+#  ("set_pending()", "pending_job()"), so that requests for the same data set wait for that job
+#  instead of starting another one. Several processes serving the GUI check and set these under a
+#  lock on the cache directory ("cache_lock()"; requires "fcntl", i.e. not on Windows, where only a
+#  single server process should be used).
+#
+#
+#  This file requires the function "evict()" in "cache.py" and "stream_zip()" in "downloads.py".
+
+
+# import modules
+import os
+import glob
+import hashlib
+import contextlib
+from timepix3.cache import evict
+from downloads import stream_zip
+
+try:
+    import fcntl
+except ImportError:
+    fcntl=None
+
+
+# version of the code: hash of the source files of the "timepix3" package
+
+def code_version(package=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'timepix3')):
+
+    digest=hashlib.sha256()
+    for file in sorted(glob.glob(os.path.join(package, '*.py'))):
+        with open(file, 'rb') as dfile:
+            digest.update(os.path.basename(file).encode())
+            digest.update(dfile.read())
+
+    return digest.hexdigest()
+
+
+# path of the cache entry of a simulation with the given parameters
+
+def result_file(cache_dir, N, op_mode, seed, version, shard_size=2**16):
+
+    identity='N={0}|op_mode={1}|seed={2}|shard_size={3}|code={4}'.format(N, op_mode, seed, shard_size, version)
+
+    return os.path.join(cache_dir, hashlib.sha256(identity.encode()).hexdigest() + '.zip')
+
+
+# cached data set: returns the cache entry opened for reading (and marked as recently used) or None if 
+# there is none; the open file can still be read if the entry is evicted by another process afterwards
+
+def lookup_result(cache_file):
+
+    try:
+        dfile=open(cache_file, 'rb')
+    except FileNotFoundError:
+        return None
+
+    try:
+        os.utime(cache_file)
+    except FileNotFoundError:
+        pass
+
+    return dfile
+
+
+# store a data set (the files in "directory", zipped) in the cache and delete least recently used 
+# data sets if the cache is too large
+
+def store_result(directory, cache_file, max_bytes=2**30):
+
+    cache_dir=os.path.dirname(cache_file)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    tmp=cache_file + '.{0}.tmp'.format(os.getpid())
+    with open(tmp, 'wb') as dfile:
+        for chunk in stream_zip(directory):
+            dfile.write(chunk)
+    os.replace(tmp, cache_file)
+
+    # data set is no longer pending
+    try:
+        os.remove(cache_file + '.job')
+    except FileNotFoundError:
+        pass
+
+    evict(cache_dir, max_bytes, suffix='.zip')
+
+    return cache_file
+
+
+# exclusive lock on the cache directory (held while checking the cache and the pending jobs)
+
+@contextlib.contextmanager
+def cache_lock(cache_dir):
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    with open(os.path.join(cache_dir, '.lock'), 'w') as dfile:
+        # record lock, which is not inherited by worker processes started while it is held (unlike "flock()")
+        if fcntl is not None:
+            fcntl.lockf(dfile, fcntl.LOCK_EX)
+        yield
+
+
+# id of the job generating the data set of a cache entry (None if there is none)
+
+def pending_job(cache_file):
+
+    try:
+        with open(cache_file + '.job') as dfile:
+            return dfile.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+# record the job generating the data set of a cache entry
+
+def set_pending(cache_file, job_id):
+
+    with open(cache_file + '.job', 'w') as dfile:
+        dfile.write(job_id)
@@ -0,0 +1,122 @@
+#  ------------------------------------------------------------------------------------------
+#  "cache.py" - Contains functions to cache decoded binary output files on disk
+#  ------------------------------------------------------------------------------------------
+#
+#  Decoding the same binary output file with the same options again and again (e.g. from
+#  notebooks or the web GUI) repeats the same work. The function "cached_file_to_df()" returns
+#  the same DataFrame as "file_to_df()" in "packing.py", but stores the decoded columns in a
+#  cache directory and returns them from there on subsequent calls.
+#
+#
+#  Cache entries are keyed by the identity of the input file (absolute path, size and
+#  modification time, or optionally a hash of its content) and the decoding options (op_mode,
+#  decode, time_data). Each entry is a ".npz" file holding one binary array per column, which is
+#  read back at disk speed. The total size of the cache is bounded ("max_bytes"): when it is
+#  exceeded, the least recently used entries are deleted.
+#
+#
+#  This file requires numpy and pandas as well as functions from "packing.py".
+
+
+# import modules
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from timepix3.packing import file_to_df
+
+
+# identity of a file: hash of its content (content=True) or its path, size and modification time
+
+def file_identity(file, content=False):
+
+    if content:
+        digest=hashlib.sha256()
+        with open(file, 'rb') as dfile:
+            for block in iter(lambda: dfile.read(2**20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    stat=os.stat(file)
+
+    return '{0}:{1}:{2}'.format(os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+
+
+# key of a cache entry for a given file and set of decoding options
+
+def cache_key(file, op_mode=0, decode=1, time_data=1, content=False):
+
+    identity='{0}|op_mode={1}|decode={2}|time_data={3}'.format(file_identity(file, content), op_mode, decode, time_data)
+
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+# delete least recently used cache entries (files ending in "suffix") until the cache is no larger 
+# than "max_bytes"
+
+def evict(cache_dir, max_bytes, suffix='.npz'):
+
+    # size and time of last use of each entry (one stat per entry; entries deleted by another
+    # process in the meantime are skipped)
+    entries=[]
+    for name in os.listdir(cache_dir):
+        if not name.endswith(suffix):
+            continue
+        try:
+            stat=os.stat(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, os.path.join(cache_dir, name)))
+    entries.sort()
+
+    total=sum(size for _, size, _ in entries)
+    for _, size, entry in entries:
+        if total <= max_bytes:
+            break
+        total -= size
+        try:
+            os.remove(entry)
+        except FileNotFoundError:     # already deleted by another process
+            pass
+
+    return 0
+
+
+# read packets from output file and return a data frame containing the pixel counter and timing values,
+# using a disk cache of previously decoded files:
+#
+# ARGUMENTS:      - op_mode, decode, time_data: see "file_to_df()" in "packing.py"
+#                 - cache_dir: directory in which decoded files are stored
+#                 - max_bytes: maximum total size of the cache in bytes
+#                 - content=True/False: identify files by a hash of their content (slower, but robust
+#                   to files being copied or touched) instead of path, size and modification time
+
+def cached_file_to_df(file, op_mode=0, decode=1, time_data=1, cache_dir='./cache', max_bytes=2**30, content=False):
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    entry=os.path.join(cache_dir, cache_key(file, op_mode, decode, time_data, content) + '.npz')
+
+    # cache hit: read columns and mark entry as recently used (an entry evicted by another process
+    # in the meantime is a cache miss)
+    try:
+        with np.load(entry) as data:
+            df=pd.DataFrame({name: data[name] for name in data.files})
+        os.utime(entry)
+        return df
+    except FileNotFoundError:
+        pass
+
+    # cache miss: decode and store columns (written to a temporary file first, so that other
+    # processes never read a partially written entry)
+    df=file_to_df(file, op_mode, decode, time_data)
+
+    tmp=entry + '.{0}.tmp'.format(os.getpid())
+    with open(tmp, 'wb') as dfile:
+        np.savez(dfile, **{name: df[name].to_numpy() for name in df.columns})
+    os.replace(tmp, entry)
+
+    evict(cache_dir, max_bytes)
+
+    return df
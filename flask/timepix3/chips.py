@@ -0,0 +1,149 @@
+#  ------------------------------------------------------------------------------------------
+#  "chips.py" - Contains functions to simulate and decode detectors made of several Timepix3
+#               chips (e.g. 2x2 quad assemblies)
+#  ------------------------------------------------------------------------------------------
+#
+#  Each Timepix3 chip has its own 256 x 256 pixel matrix and its own stream of 48-bit packets;
+#  the packet format has no room for a chip id. Multi-chip detectors are therefore handled with
+#  one binary output file per chip, named after the chip id with "chip_file_name()" (e.g.
+#  "packets.bin" -> "packets_chip0.bin", "packets_chip1.bin", ...). Every chip is simulated and
+#  decoded in its own worker process, so that a quad is processed about as fast as a single
+#  chip on four cores.
+#
+#
+#  The position of each chip in the detector is described by a layout: a dictionary mapping the
+#  chip id to the (x, y) offset of the chip in global pixel coordinates and whether the chip is
+#  rotated by 180 degrees. The default "quad_layout" places chips 0 and 1 next to each other in
+#  the bottom row and chips 2 and 3 (rotated, as in common quad assemblies) in the top row of a
+#  512 x 512 pixel matrix.
+#
+#
+#  Key functions are:
+#         - "simulate_chips()": simulate hits on each chip and write one binary file per chip
+#         - "decode_chips()": decode the binary files of all chips into one DataFrame with the
+#                             columns of "file_to_df()" plus 'chip', 'x_global' and 'y_global'
+#         - "local_to_global()": convert chip id and pixel coordinates to global coordinates
+#
+#
+#  This file requires numpy and pandas as well as functions from "generate.py" and "packing.py".
+
+
+# import modules
+import os
+import numpy as np
+import pandas as pd
+from numpy import random as rd
+from concurrent.futures import ProcessPoolExecutor
+from timepix3.packing import file_to_chunks
+from timepix3.generate import simulate
+
+
+# position of each chip in a 2x2 quad: chip id -> (x offset, y offset, rotated by 180 degrees)
+quad_layout={0: (0, 0, False), 1: (256, 0, False), 2: (256, 256, True), 3: (0, 256, True)}
+
+
+# name of the output file of a given chip:
+#    (inserts "_chip<id>" before the file extension)
+
+def chip_file_name(name, chip):
+
+    root, ext=os.path.splitext(name)
+
+    return '{0}_chip{1}{2}'.format(root, chip, ext)
+
+
+# convert chip id and pixel coordinates on the chip to global pixel coordinates
+
+def local_to_global(chip, x, y, layout=quad_layout):
+
+    chip=np.asarray(chip)
+    x=np.asarray(x, dtype=np.int64)
+    y=np.asarray(y, dtype=np.int64)
+
+    # look up offsets and orientation of each hit's chip
+    chips=np.array(sorted(layout))
+    offsets=np.array([layout[k] for k in chips], dtype=np.int64)
+    row=np.searchsorted(chips, chip)
+    x_off, y_off, rotated = offsets[row,0], offsets[row,1], offsets[row,2].astype(bool)
+
+    x_global=x_off + np.where(rotated, 255 - x, x)
+    y_global=y_off + np.where(rotated, 255 - y, y)
+
+    return x_global, y_global
+
+
+# simulate and write the data of a single chip (worker function for "simulate_chips()")
+
+def simulate_chip(args):
+
+    N, op_mode, bin_name, csv_name, seed = args
+
+    # each worker process needs its own random state
+    return simulate(N, op_mode, bin_name, csv_name, seed=seed)
+
+
+# generate N random hits on each chip, process them and write one binary (and csv) file per chip:
+#        ARGUMENTS:   - N : number of hits per chip
+#                     - op_mode=0/1: ToA & ToT Mode (=0) or ToA Only Mode (=1)
+#                     - n_chips: number of chips (default: 4, i.e. a quad)
+#                     - bin_name, csv_name: file names, see "chip_file_name()"
+#                     - workers: number of worker processes (default: one per chip)
+#                     - seed: random seed; chip k is simulated with seed+k (default: random)
+
+def simulate_chips(N, op_mode=0, n_chips=4, bin_name='packets.bin', csv_name='values.csv', workers=None, seed=None):
+
+    if seed is None:
+        seed=rd.randint(0, 2**31 - n_chips)
+
+    args=[(N, op_mode, chip_file_name(bin_name, k), chip_file_name(csv_name, k), seed + k) for k in np.arange(n_chips)]
+
+    with ProcessPoolExecutor(max_workers=workers or n_chips) as pool:
+        list(pool.map(simulate_chip, args))
+
+    return 0
+
+
+# decode the binary file of a single chip into a DataFrame (worker function for "decode_chips()")
+
+def decode_chip(args):
+
+    file, chip, op_mode, decode = args
+
+    chunks=list(file_to_chunks(file, op_mode, decode))
+    columns={key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]} if chunks else {}
+
+    df=pd.DataFrame(columns)
+    df['chip']=chip
+
+    return df
+
+
+# decode the binary files of several chips, each in its own worker process:
+#
+# ARGUMENTS:      - files: list of binary files, or base name of the files (see "chip_file_name()")
+#                 - n_chips: number of chips (only needed if a base name is given)
+#                 - op_mode=0/1: ToA & ToT Mode (=0) or ToA Only Mode (=1)
+#                 - decode=0/1 : decoded (=1) or encoded (=0) pixel counters
+#                 - layout: position of each chip (see header comment)
+#                 - workers: number of worker processes (default: one per chip)
+#
+# RETURNS:        - DataFrame with the hits of all chips, sorted by time, with the additional
+#                   columns 'chip', 'x_global' and 'y_global'
+
+def decode_chips(files='packets.bin', n_chips=4, op_mode=0, decode=1, layout=quad_layout, workers=None):
+
+    if isinstance(files, str):
+        files=[chip_file_name(files, k) for k in np.arange(n_chips)]
+
+    args=[(file, k, op_mode, decode) for k, file in enumerate(files)]
+
+    with ProcessPoolExecutor(max_workers=workers or len(files)) as pool:
+        df=pd.concat(list(pool.map(decode_chip, args)), ignore_index=True)
+
+    if len(df)==0:
+        return df
+
+    df['x_global'], df['y_global'] = local_to_global(df['chip'], df['x'], df['y'], layout)
+    df=df.sort_values(by=['time'], kind='stable', ignore_index=True)
+
+    return df
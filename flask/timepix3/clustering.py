@@ -0,0 +1,182 @@
+#  ------------------------------------------------------------------------------------------
+#  "clustering.py" - Contains functions to group decoded hits into clusters (particle tracks)
+#  ------------------------------------------------------------------------------------------
+#
+#  A particle crossing the sensor triggers several neighbouring pixels at almost the same time
+#  (see "gen_phys_hits()" in "generate.py"). The functions in this file group hits back into
+#  clusters: two hits belong to the same cluster if their pixels are neighbours (8-connected,
+#  i.e. including diagonals) and their start times differ by no more than "window" seconds.
+#  Clusters are the connected groups of hits under this condition.
+#
+#
+#  The function "cluster_hits()" labels a set of hits in memory:
+#         1. the hits are sorted by time; for each lag k = 1, 2, ... hit i is compared with hit
+#            i+k for all i at once (vectorised neighbour test), as long as any pair at that lag
+#            is within the time window (a sliding window over the sorted hits);
+#         2. the resulting pairs of neighbouring hits are combined into clusters with a vectorised
+#            union-find (pairs are repeatedly linked to the lower label, followed by pointer
+#            jumping until no label changes).
+#  Cluster ids count up from 0 in order of the first hit of each cluster.
+#
+#
+#  The generator "cluster_chunks()" does the same for a stream of decoded chunks (e.g. from
+#  "file_to_chunks()" in "packing.py"), so that tens of millions of hits can be processed in
+#  constant memory. Clusters that may still continue into the next chunk ("open" clusters,
+#  with a hit within the time window of the end of the chunk) are carried over and only
+#  returned once they are complete.
+#
+#
+#  This file requires numpy.
+
+
+# import modules
+import numpy as np
+
+
+# find all pairs of neighbouring hits within the time window:
+#    (x, y, t must be sorted by t; returns arrays of indices i < j of the connected pairs)
+
+def find_neighbours(x, y, t, window):
+
+    first, second = [], []
+
+    # indices i whose hit i+k may still be within the time window of hit i
+    active=np.arange(len(t))
+
+    k=1
+    while True:
+
+        # keep only pairs at lag k that are within the time window
+        active=active[active + k < len(t)]
+        active=active[t[active + k] - t[active] <= window]
+        if len(active)==0:
+            break
+
+        # vectorised neighbour test (8-connected)
+        near=(np.abs(x[active + k] - x[active]) <= 1) & (np.abs(y[active + k] - y[active]) <= 1)
+        first.append(active[near])
+        second.append(active[near] + k)
+
+        k+=1
+
+    if len(first)==0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    return np.concatenate(first), np.concatenate(second)
+
+
+# label connected components of "n" hits given the pairs (i, j) of connected hits:
+#    (vectorised union-find; returns for each hit the smallest index of any hit in its cluster)
+
+def label_components(n, i, j):
+
+    labels=np.arange(n)
+
+    while True:
+
+        # link both hits of each pair to the lower of their labels
+        low=np.minimum(labels[i], labels[j])
+        new=labels.copy()
+        np.minimum.at(new, labels[i], low)
+        np.minimum.at(new, labels[j], low)
+
+        # pointer jumping: follow labels to the root of each tree
+        while True:
+            jumped=new[new]
+            if (jumped==new).all():
+                break
+            new=jumped
+
+        if (new==labels).all():
+            return labels
+        labels=new
+
+
+# label clusters of hits:
+#
+# ARGUMENTS:      - x, y: pixel coordinates of the hits
+#                 - t: start times of the hits in seconds (need not be sorted)
+#                 - window: maximum time difference between neighbouring hits of a cluster
+#
+# RETURNS:        - array with the cluster id of each hit (in the order of the input)
+
+def cluster_hits(x, y, t, window=200e-9):
+
+    x=np.asarray(x, dtype=np.int64)
+    y=np.asarray(y, dtype=np.int64)
+    t=np.asarray(t, dtype=float)
+
+    # sort hits by time
+    order=np.argsort(t, kind='stable')
+    i, j = find_neighbours(x[order], y[order], t[order], window)
+    labels=label_components(len(t), i, j)
+
+    # number clusters in order of their first hit
+    ids=np.empty(len(t), dtype=np.int64)
+    ids[order]=np.unique(labels, return_inverse=True)[1]
+
+    return ids
+
+
+# label clusters in a stream of decoded chunks:
+#
+# ARGUMENTS:      - chunks: iterable of dictionaries of columns (with at least 'x', 'y' and the time
+#                   column); chunks must follow each other in time, hits within a chunk can be in
+#                   any order
+#                 - window: maximum time difference between neighbouring hits of a cluster
+#                 - time_column: name of the column holding the hit times ('time' for chunks from
+#                   "file_to_chunks()", which is unwrapped over the ToA range)
+#
+# RETURNS:        - generator of dictionaries with the columns of all hits in complete clusters,
+#                   sorted by cluster, with the additional column 'cluster' (ids are unique over
+#                   the whole stream)
+
+def cluster_chunks(chunks, window=200e-9, time_column='time'):
+
+    carry=None       # hits of open clusters from previous chunks
+    next_id=0
+
+    for chunk in chunks:
+
+        # combine with hits carried over from the last chunk
+        if carry is not None:
+            chunk={key: np.concatenate([carry[key], np.asarray(chunk[key])]) for key in carry}
+        else:
+            chunk={key: np.asarray(value) for key, value in chunk.items()}
+
+        if len(chunk[time_column])==0:
+            continue
+
+        t=chunk[time_column]
+        ids=cluster_hits(chunk['x'], chunk['y'], t, window)
+
+        # clusters with a hit within the time window of the latest hit may still grow
+        last=np.full(ids.max()+1, -np.inf)
+        np.maximum.at(last, ids, t)
+        is_open=(last >= t.max() - window)[ids]
+
+        carry={key: value[is_open] for key, value in chunk.items()}
+
+        out, next_id=number_clusters({key: value[~is_open] for key, value in chunk.items()}, ids[~is_open], next_id)
+        if len(out['cluster']) > 0:
+            yield out
+
+    # all remaining clusters are complete at the end of the stream
+    if (carry is not None) and (len(carry[time_column]) > 0):
+        ids=cluster_hits(carry['x'], carry['y'], carry[time_column], window)
+        out, next_id=number_clusters(carry, ids, next_id)
+        yield out
+
+
+# sort hits by cluster and re-number clusters consecutively from "next_id":
+#    (returns columns with added 'cluster' column and the next unused id)
+
+def number_clusters(columns, ids, next_id):
+
+    local=np.unique(ids, return_inverse=True)[1]
+    order=np.argsort(local, kind='stable')
+
+    out={key: value[order] for key, value in columns.items()}
+    out['cluster']=local[order] + next_id
+
+    return out, next_id + (local.max()+1 if len(local) else 0)
@@ -8,7 +8,8 @@
 #
 #  This file provides the functions "counter_encode()" and "counter_decode()" which convert 
 #  between a sequential count value and the encoded pixel counter values for each type of Timepix3 
-#  pixel counter. 
+#  pixel counter. The functions "counter_encode_array()" and "counter_decode_array()" do the
+#  same for whole numpy arrays of values, using look-up tables for the LFSR counters. 
 #
 #  Usage of the functions is explained in more detail at the end of the file.
 #
@@ -122,6 +123,50 @@ def LFSR_decode(encoded,counter):
     return N
 
 
+# look-up tables for the iToT, ToT, 10-bit PC, 4-bit PC counters:
+#       - returns "encode" table (sequential count -> LFSR value) and "decode" table 
+#         (LFSR value -> sequential count) with the same conventions as "LFSR_encode()"
+#         and "LFSR_decode()"
+#       - values which are never produced by the LFSR are set to the sentinel -1 in the 
+#         decode table (instead of being mapped to 0), so that corrupted codes can be found
+#       - tables are built once per counter type and kept in "_LFSR_tables"
+
+_LFSR_tables={}
+
+def LFSR_tables(counter):
+    
+    # set up appropriate LFSR:
+    register_size, tap_1,tap_2,tap_3,tap_4,overflow_toggle, overflow_val= set_LFSR(counter)
+    
+    if register_size in _LFSR_tables:
+        return _LFSR_tables[register_size]
+    
+    # run LFSR through one full period, starting from the seed:
+    seed=2**register_size-1
+    encode=np.empty(seed+1, dtype=np.int64)
+    decode=np.full(2**register_size, -1, dtype=np.int64)
+    
+    m=seed
+    encode[0]=seed
+    for N in np.arange(1, seed+1):
+        m= LFSR(m,register_size,tap_1, tap_2, tap_3, tap_4)
+        encode[N]=m
+        if decode[m]==-1:
+            decode[m]=N
+    
+    # a full period brings the register back to the seed (decoded as 0):
+    decode[seed]=0
+    
+    # implement overflow control
+    if overflow_toggle:
+        encode[seed-1:]=overflow_val
+        decode[overflow_val]=seed-1
+    
+    _LFSR_tables[register_size]=(encode, decode)
+    
+    return encode, decode
+
+
 # convert from Binary encoding to Gray encoding
 
 def bin_to_gray(n):
@@ -184,5 +229,45 @@ def counter_decode(n,counter):
         decoded=LFSR_decode(n,counter)
    
     return decoded
+
+
+# array versions of the two functions above: convert whole numpy arrays of counts or counter
+# values at once using look-up tables (LFSR counters) or bit operations (ToA, fToA)
+#       - values are returned as int64 arrays
+#       - if sentinel=True, LFSR values which can not be produced by the counter are decoded 
+#         to -1 rather than to 0 (as done by "counter_decode()")
+
+def counter_encode_array(N, counter):
+    
+    N=np.asarray(N, dtype=np.int64)
+    
+    if (counter=='ToA') | (counter=='toa'):
+        encoded=N ^ (N >> 1)
+    elif (counter=='fToA') | (counter=='ftoa'):
+        encoded=np.minimum(N, 15)
+    else:
+        encode, decode=LFSR_tables(counter)
+        encoded=encode[np.clip(N, 0, len(encode)-1)]
+    
+    return encoded
+
+
+def counter_decode_array(n, counter, sentinel=False):
     
-    
\ No newline at end of file
+    n=np.asarray(n, dtype=np.int64)
+    
+    if (counter=='ToA') | (counter=='toa'):
+        decoded=n.copy()
+        shift=1
+        while shift < 64:
+            decoded ^= (decoded >> shift)
+            shift <<=1
+    elif (counter=='fToA') | (counter=='ftoa'):
+        decoded=n.copy()
+    else:
+        encode, decode=LFSR_tables(counter)
+        decoded=decode[n & (len(decode)-1)]
+        if not sentinel:
+            decoded=np.where(decoded < 0, 0, decoded)
+    
+    return decoded
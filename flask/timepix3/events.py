@@ -0,0 +1,155 @@
+#  ------------------------------------------------------------------------------------------
+#  "events.py" - Contains functions to build events from decoded hits and external trigger
+#                timestamps
+#  ------------------------------------------------------------------------------------------
+#
+#  Each external trigger at time T opens a coincidence window [T + offset, T + offset + width).
+#  Hits with a time inside that window belong to the event of the trigger. If windows overlap,
+#  a hit is assigned to the latest trigger whose window has opened before the hit.
+#
+#
+#  Trigger timestamps must be sorted. Instead of comparing every hit with every trigger, the
+#  window of each hit is found by a binary search ("np.searchsorted") over the window start
+#  times, i.e. in O(N log M) for N hits and M triggers:
+#         - "assign_events()" returns the event (trigger index) of each hit, -1 if none
+#         - "build_events()" groups the hits by event and returns the hit indices of each event
+#         - "iter_events()" does the same for a stream of decoded chunks (e.g. from
+#           "file_to_chunks()" in "packing.py") and returns the hits of each event as soon as
+#           its window has closed (only the triggers whose windows can hold hits of a chunk
+#           are searched and triggers without hits are skipped, so the work per chunk does not
+#           grow with the total number of triggers)
+#
+#
+#  This file requires numpy.
+
+
+# import modules
+import numpy as np
+
+
+# find the event (index of the trigger) of each hit:
+#
+# ARGUMENTS:      - triggers: sorted array of trigger times in seconds
+#                 - t: hit times in seconds
+#                 - offset: start of the coincidence window relative to the trigger
+#                 - width: length of the coincidence window
+#
+# RETURNS:        - array with the event index of each hit (-1 for hits outside of all windows)
+
+def assign_events(triggers, t, offset=0, width=1e-6):
+
+    triggers=np.asarray(triggers, dtype=np.float64)
+    t=np.asarray(t, dtype=np.float64)
+
+    # latest window that opened before (or at) each hit
+    event=np.searchsorted(triggers + offset, t, side='right') - 1
+
+    # hit must also be before the window closes
+    inside=(event >= 0)
+    inside[inside]=t[inside] < triggers[event[inside]] + offset + width
+
+    return np.where(inside, event, -1)
+
+
+# group hits by event among the events first, ..., last-1 (window start and end times "opens" and
+# "closes", e.g. triggers + offset and triggers + offset + width; hits which are in none of these
+# windows get the event -1):
+#    (returns the event index of each hit, the hit indices sorted by event and the position of
+#     the first hit of each event in that list, with one extra entry at the end: the hits of
+#     event first+k are  hits[starts[k]:starts[k+1]] )
+
+def group_events(opens, closes, t, first=0, last=None):
+
+    if last is None:
+        last=len(opens)
+    t=np.asarray(t, dtype=np.float64)
+
+    # latest window that opened before (or at) each hit and that has not closed yet
+    event=np.searchsorted(opens[first:last], t, side='right') - 1
+    inside=(event >= 0)
+    inside[inside]=t[inside] < closes[first:last][event[inside]]
+    event=np.where(inside, event + first, -1)
+
+    # hits outside of all windows are dropped; sort only if the hits are not in time order
+    hits=np.flatnonzero(event >= 0)
+    if (np.diff(event[hits]) < 0).any():
+        hits=hits[np.argsort(event[hits], kind='stable')]
+
+    starts=np.searchsorted(event[hits], np.arange(first, last+1))
+
+    return event, hits, starts
+
+
+# group hits by event:
+#    (returns the event index of each hit, the hit indices sorted by event and the position of
+#     the first hit of each event in that list, with one extra entry at the end: the hits of
+#     event k are  order[starts[k]:starts[k+1]] )
+
+def build_events(triggers, t, offset=0, width=1e-6):
+
+    opens=np.asarray(triggers, dtype=np.float64) + offset
+
+    return group_events(opens, opens + width, t)
+
+
+# events 0, ..., n-1 of the bounds "starts" of "group_events()" (only those with hits unless "empty")
+
+def event_range(starts, n, empty=False):
+
+    if empty:
+        return np.arange(n)
+
+    return np.flatnonzero(starts[1:n+1] > starts[:n])
+
+
+# build events from a stream of decoded chunks (dictionaries of columns):
+#
+# ARGUMENTS:      - triggers, offset, width: see "assign_events()"
+#                 - chunks: iterable of chunks that follow each other in time
+#                 - time_column: name of the column holding the hit times
+#                 - empty=False/True: skip events without hits (=False) or return them as well (=True)
+#
+# RETURNS:        - generator of (event index, dictionary with the columns of the hits of the event);
+#                   each event is returned once its window has closed (or at the end of the stream)
+
+def iter_events(triggers, chunks, offset=0, width=1e-6, time_column='time', empty=False):
+
+    opens=np.asarray(triggers, dtype=np.float64) + offset     # window start and end times
+    closes=opens + width
+    carry=None       # hits of events whose window has not closed yet
+    first=0          # first event that has not been returned yet
+
+    for chunk in chunks:
+
+        if carry is not None:
+            chunk={key: np.concatenate([carry[key], np.asarray(chunk[key])]) for key in carry}
+        else:
+            chunk={key: np.asarray(value) for key, value in chunk.items()}
+
+        if len(chunk[time_column])==0:
+            continue
+
+        # only events from the first one not yet returned up to the latest window opened before the
+        # latest hit can hold hits of the chunk (earlier windows closed before the previous chunk ended)
+        t=chunk[time_column]
+        t_max=t.max()
+        end=max(first, np.searchsorted(opens, t_max, side='right'))
+        event, hits, starts=group_events(opens, closes, t, first, end)
+
+        # events whose window closed before the latest hit are complete
+        last=max(first, np.searchsorted(closes, t_max, side='right'))
+
+        for k in event_range(starts, last - first, empty):
+            sel=hits[starts[k]:starts[k+1]]
+            yield first + k, {key: value[sel] for key, value in chunk.items()}
+
+        # keep only hits of events that may still receive hits
+        carry={key: value[event >= last] for key, value in chunk.items()}
+        first=last
+
+    # remaining events are complete at the end of the stream
+    if carry is not None:
+        event, hits, starts=group_events(opens, closes, carry[time_column], first)
+        for k in event_range(starts, len(opens) - first, empty):
+            sel=hits[starts[k]:starts[k+1]]
+            yield first + k, {key: value[sel] for key, value in carry.items()}
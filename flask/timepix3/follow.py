@@ -0,0 +1,79 @@
+#  ------------------------------------------------------------------------------------------
+#  "follow.py" - Contains functions to decode a binary output file while it is still being
+#                written (e.g. during data acquisition)
+#  ------------------------------------------------------------------------------------------
+#
+#  The function "follow_file()" watches a binary output file and decodes only the packets
+#  that have been appended since the last read. The file is polled for changes in size; new
+#  whole packets are read from the position of the last packet with "file_to_packets()" (the
+#  file is never re-read from the start) and an incomplete packet at the end of the file is left
+#  for the next read, once all of its 6 bytes have been written.
+#
+#
+#  Each chunk of new packets is decoded with "packets_to_columns()" into a dictionary of numpy
+#  arrays. The ToA is unwrapped over the 0.4096 ms range of the counter with the state carried
+#  from one chunk to the next (column 'time', see "unwrap_toa()" in "time_conversion.py"). The
+#  chunks are returned by the generator and passed to any number of subscriber functions, e.g.
+#  for online monitoring:
+#
+#        >>> for chunk in follow_file('packets.bin', subscribers=[print_rate], timeout=10):
+#        ...     pass
+#
+#
+#  This file requires functions from "packing.py".
+
+
+# import modules
+import time
+from os.path import getsize, exists
+from timepix3.packing import file_to_packets, packets_to_columns, packets_to_time, mask_to_addr, mask_packets
+
+
+# follow binary output file and decode newly appended packets:
+#
+# ARGUMENTS:      - op_mode=0/1: ToA & ToT Mode (=0) or ToA Only Mode (=1)
+#                 - decode=0/1 : decoded (=1) or encoded (=0) pixel counters
+#                 - subscribers: list of functions which are called with each decoded chunk
+#                 - poll: time in seconds between checks of the file size
+#                 - timeout: stop once no new packets have been written for "timeout" seconds
+#                            (None: follow the file until the generator is closed)
+#                 - max_packets: maximum number of packets decoded per chunk
+#                 - mask: pixel mask (see "mask_to_addr()" in "packing.py"); hits on disabled pixels 
+#                         are dropped before decoding
+#
+# RETURNS:        - generator of dictionaries with the columns of each chunk
+
+def follow_file(file, op_mode=0, decode=1, subscribers=(), poll=1e-3, timeout=None, max_packets=2**20, mask=None):
+
+    offset=0             # number of packets read so far
+    state=(-1,0)         # ToA unwrapping state
+    last_data=time.monotonic()
+
+    addr_mask=None if mask is None else mask_to_addr(mask)
+
+    while True:
+
+        # number of whole packets available
+        n= int(getsize(file)//6) - offset if exists(file) else 0
+
+        # wait for new packets (or stop if there have been none for too long)
+        if n <= 0:
+            if (timeout is not None) and (time.monotonic() - last_data > timeout):
+                return
+            time.sleep(poll)
+            continue
+
+        # read and decode only the new packets
+        packets=file_to_packets(file, offset, min(n, max_packets))
+        offset += len(packets)
+        last_data=time.monotonic()
+
+        packets=mask_packets(packets, addr_mask=addr_mask)
+        columns=packets_to_columns(packets, op_mode, decode)
+        columns['time'], state=packets_to_time(packets, state)
+
+        # push chunk to subscribers
+        for subscriber in subscribers:
+            subscriber(columns)
+
+        yield columns
@@ -11,63 +11,69 @@
 #  The function "simulate" generates hit data, processes it (ToA & ToT Mode or ToA Only Mode)
 #  and writes the resulting bit packets to a binary file. At the same time, the associated 
 #  hit timing data and decoded pixel counter values are written to a csv file for reference. 
-#  See the comments below on more information about usage of the function.
+#  See the comments below on more information about usage of the function. Large data sets can be 
+#  generated in parallel shards, reproducibly for a given seed. "simulate_stream" simulates runs 
+#  longer than the ToA range window by window, appending the packets of each window to the file.
+#  "simulate_rate" generates hits at a given flux and reports the rate of accepted hits per pixel.
 #
 #
-#  The function "visualise" reads in a csv file containing hit information (columns: 'x', 
-#  'y', 'start', 'stop') and returns an animated gif of the hits with the desired number of 
-#  steps in time. Note that since the gif frame rate is constant increasing the number of steps 
+#  The function "visualise" reads in hit information (a csv file with columns 'x', 'y', 'start', 
+#  'stop', a binary output file, a cache file or hit data in memory) and returns an animated gif 
+#  of the hits with the desired number of steps in time. Note that since the gif frame rate is constant increasing the number of steps 
 #  will also increase the length of the gif. 
 #
 #
-#  This file requires numpy, celluloid and pandas as well as functions from "packing.py" . 
-#  The modules matplotlib and celluloid are additionally required for visualisation.
+#  This file requires numpy and pandas as well as functions from "packing.py", "hits.py" and 
+#  "table.py". 
+#  The module matplotlib (and ffmpeg for long animations or MP4 output) is additionally required 
+#  for visualisation.
 #
 #                                                                    David Amorim, 2022        
 
 
 # import modules
+import os
 import pandas as pd 
 import numpy as np
 from numpy import random as rd
-from celluloid import Camera
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
-from timepix3.packing import raw_to_file, file_to_df
+from matplotlib import animation
+from timepix3.packing import raw_to_file, file_to_df, raw_hits, raw_to_unpacked, values_to_file, raw_dtype, xy_to_addr, addr_to_xy
+from timepix3.hits import pixel_state, accept_hits
+from timepix3.table import HitTable, file_to_table
 
 
 # generate N hits of random pixels at random times:
 #     NOTE: -essentially generates pixel noise
+#           -rng: numpy random Generator (e.g. "np.random.default_rng(seed)"); a new unseeded 
+#            Generator is used if none is given
+#           -t_min, t_max: time range of the hit start times (default: ToA range)
  
-def gen_hits(N):
+def gen_hits(N, rng=None, t_min=0, t_max=409.6e-6):
     
-    # generate random coordinates
-    x=rd.randint(0,256,size=N)
-    y=rd.randint(0,256, size=N)
-
-    # generate random timing data in ToA range
-    start=rd.uniform(0, 409.6e-6, size=N)
-    stop=np.empty(N)
-
-    for i in np.arange(N):
-        stop[i]=start[i]+ 25e-9 * rd.uniform(0,1022)
+    if rng is None:
+        rng=rd.default_rng()
     
-    # combine columns into DataFrame
-    df=pd.DataFrame()
-    df['x']=x
-    df['y']=y
-    df['start']=start
-    df['stop']=stop
+    # generate random coordinates
+    x=rng.integers(0, 256, size=N, dtype=np.uint8)
+    y=rng.integers(0, 256, size=N, dtype=np.uint8)
 
-    # sort by start time:
-    df=df.sort_values(by=['start'])
+    # generate random timing data in ToA range:
+    #    (sorted uniform start times are drawn directly as normalised cumulative sums of exponential
+    #     variates, so that no sort is needed)
+    gaps=np.cumsum(rng.standard_exponential(size=N+1))
+    start=t_min + (t_max - t_min) * gaps[:N] / gaps[N]
+    stop=start + 25e-9 * rng.uniform(0, 1022, size=N)
     
-    # return data
-    return df
+    # combine columns into compact structured array (see "raw_dtype" in "packing.py")
+    return raw_hits(x, y, start, stop)
 
-# generates hits corresponding to N particle detections; returns DataFrame with raw hit timing and address data
-#    NOTE:  - output DataFrame will be about 'mean_len' (default:10) times larger than number of particles (N) !      
+# generates hits corresponding to N particle detections; returns structured array with raw hit timing and address data
+#    NOTE:  - output array will be about 'mean_len' (default:10) times larger than number of particles (N) !      
+#           - rng, t_min, t_max: see "gen_hits()" (t_min, t_max: range of the particle arrival times)
 
-def gen_phys_hits(N):
+def gen_phys_hits(N, rng=None, t_min=0, t_max=409.6e-6):
     
     # simulation parameters [adjust later!]
     
@@ -81,76 +87,157 @@ def gen_phys_hits(N):
     mean_len    = 10              # mean track length [Gaussian]
     std_len     = 5               # std of track length
     
-    # declare arrays
-    X, Y= np.array([], dtype='int'), np.array([], dtype='int') 
-    Start, Stop = np.array([], dtype='float'), np.array([], dtype='float')
+    if rng is None:
+        rng=rd.default_rng()
+    
+    # generate random initial hits of all particles:
+    x_0=rng.integers(0, 256, size=N)
+    y_0=rng.integers(0, 256, size=N)
+    start_0=rng.uniform(t_min, t_max, size=N)
+    stop_0=start_0 + 25e-9 * np.abs(rng.normal(loc=mean_tot, scale=std_tot, size=N))
+    theta_0=rng.uniform(0, 2*np.pi, size=N)
+    
+    # randomly determine the length of each track
+    l=np.abs(rng.normal(mean_len, std_len, size=N)).astype(np.int64)
+    
+    # flat index over all track steps: particle of each step and step number j=1..l within the track
+    first=np.cumsum(l) - l
+    particle=np.repeat(np.arange(N), l)
+    j=np.arange(len(particle)) - first[particle] + 1
+    
+    # allow for particle scattering: deflection after each step, summed over the previous steps 
+    # of the same track
+    kick=rng.choice([0, 1, -1], size=len(particle), p=[1-scatter_prob,0.5* scatter_prob,0.5* scatter_prob])*rng.poisson(scatter_ang, size=len(particle))
+    kicks=np.cumsum(kick) - kick
+    theta=theta_0[particle] + kicks - kicks[first[particle]]
+    
+    # determine new position of particle at each step
+    x=np.trunc(x_0[particle] + j * np.cos(theta)).astype(np.int64)
+    y=np.trunc(y_0[particle] + j * np.sin(theta)).astype(np.int64)
+    
+    # stop track once particle has left sensor area: keep only steps with no step outside 
+    # the pixel array up to and including them
+    outside=((x < 0) | (x > 255) | (y < 0) | (y > 255)).astype(np.int64)
+    left=np.cumsum(outside)
+    left=left - (left - outside)[first[particle]]
+    inside=(left==0)
+    x, y, particle = x[inside], y[inside], particle[inside]
+    
+    # calculate distance travelled, update timing data accordingly:
+    r=np.sqrt( (x_0[particle]-x)**2 + (y_0[particle]-y)**2)
+    start=start_0[particle] + r/speed
+    stop=stop_0[particle] + r/speed - np.exp(-r*decay_const)
+    
+    # combine initial hits and tracks
+    X, Y = np.append(x_0, x), np.append(y_0, y)
+    Start, Stop = np.append(start_0, start), np.append(stop_0, stop)
     
-    # loop through number of particles
-    for i in np.arange(N):
-        
-        # generate a random initial hit:
-        x_0=int(rd.uniform(0,256))
-        y_0=int(rd.uniform(0,256))
-        start_0=rd.uniform(0, 409.6e-6)
-        stop_0= start_0 + 25e-9 * np.abs(rd.normal(loc=mean_tot, scale=std_tot))
-        theta_0=rd.uniform(0, 2*np.pi)
-        
-        # randomly determine the length of the track
-        l=int(np.abs(rd.normal(mean_len,std_len)))
-        
-        # declare arrays
-        x, y              = np.array([], dtype='int'), np.array([], dtype='int')
-        start, stop       = np.array([], dtype='float'), np.array([], dtype='float')
-        x, y, start, stop = np.append(x,x_0),np.append(y,y_0), np.append(start,start_0),np.append(stop,stop_0)
-    
-        # loop through track:
-        for j in np.arange(l)+1:
-            
-            # determine new position of particle
-            x_new= int(x[0]+ j * np.cos(theta_0))
-            y_new= int(y[0]+j * np.sin(theta_0))
-            
-            # confirm that particle still in pixel array:
-            if (x_new >= 0) & (x_new <= 255) & (y_new >= 0) & (y_new <= 255):
-                
-                # update particle position
-                x=np.append(x,x_new)
-                y=np.append(y,y_new)
-                
-                # calculate distance travelled, update timing data accordingly:
-                r= np.sqrt( (x_0-x_new)**2+ (y_0-y_new)**2)
-                start=np.append(start,start_0+ r/speed)
-                stop=np.append(stop,stop_0+r/speed-np.exp(-r*decay_const))
-                
-                # allow for particle scattering
-                theta_0 += rd.choice([0, 1, -1], p=[1-scatter_prob,0.5* scatter_prob,0.5* scatter_prob])*rd.poisson(scatter_ang)
-            
-            # stop if particle has left sensor area 
-            else:
-                break
-        
-        # add track to arrays
-        Y=np.append(Y,y)
-        X=np.append(X,x)
-        Start=np.append(Start, start)
-        Stop=np.append(Stop, stop)
-     
-    # combine columns into DataFrame
-    df=pd.DataFrame()
-    df['x']=X
-    df['y']=Y
-    df['start']=Start
-    df['stop']=Stop
-
     # add noise
-    df2=gen_hits(int(N*(1-snr)))
-    df=pd.concat([df,df2])
+    noise=gen_hits(int(N*(1-snr)), rng, t_min, t_max)
+
+    # combine columns into compact structured array, sorted by start time
+    return raw_hits(np.append(X, noise['x']), np.append(Y, noise['y']), np.append(Start, noise['start']), np.append(Stop, noise['stop']))
+
+# name of the output file of a given shard:
+#    (inserts "_shard<k>" before the file extension, e.g. "packets.bin" -> "packets_shard0.bin")
+
+def shard_file_name(name, shard):
+    
+    root, ext=os.path.splitext(name)
+    
+    return '{0}_shard{1}{2}'.format(root, shard, ext)
+
+
+# generate the hits of a single shard and, if file names are given, process and write them
+# (worker function for "simulate()")
 
-    # sort by start time:
-    df=df.sort_values(by=['start']) 
+def simulate_shard(args):
     
-    # return DataFrame
-    return df
+    n, seed, op_mode, bin_name, csv_name = args
+    
+    # each shard has its own independent random stream
+    hits=gen_phys_hits(n, rd.default_rng(seed))
+    
+    if bin_name is None:
+        return hits
+    
+    raw_to_file(bin_name, hits, op_mode)
+    file_to_df(bin_name, op_mode, decode=1, save=1, name=csv_name)
+    
+    return 0
+
+
+# generate hits at a given flux over a given duration, with Poisson statistics on each pixel:
+#     ARGUMENTS: - rate: hits per second per pixel; a number (same for all pixels) or a 256x256 
+#                        rate map (indexed [y, x])
+#                - duration: length of the acquisition in seconds
+#                - rng: numpy random Generator (see "gen_hits()")
+#                - max_tot: hit lengths are uniform between 0 and "max_tot" clock ticks (25 ns)
+#
+#     NOTE: -hits are returned as a structured array of "raw_dtype" ordered by pixel address and 
+#            by start time on each pixel (NOT by start time overall), which is the order in which
+#            "accept_hits()" in "hits.py" processes them
+#           -the arrival times on each pixel are the cumulative sums of exponential inter-arrival 
+#            times, normalised to the duration, for a Poisson number of hits
+
+def gen_rate_hits(rate, duration, rng=None, max_tot=1022):
+    
+    if rng is None:
+        rng=rd.default_rng()
+    
+    # rate of each pixel, in order of pixel address
+    x_pix, y_pix = addr_to_xy(np.arange(2**16))
+    rate=np.broadcast_to(np.asarray(rate, dtype=np.float64), (256,256))[y_pix, x_pix]
+    
+    # number of hits on each pixel
+    n=rng.poisson(rate * duration)
+    
+    # exponential inter-arrival times (one more than hits per pixel), summed on each pixel
+    pixel=np.repeat(np.arange(2**16), n+1)
+    last=np.cumsum(n+1) - 1
+    gaps=np.cumsum(rng.standard_exponential(size=len(pixel)))
+    gaps=gaps - np.append(0, gaps[last[:-1]])[pixel]
+    
+    # arrival times: normalised by the sum over all gaps of the pixel (last entry is dropped)
+    hit=np.ones(len(pixel), dtype=bool)
+    hit[last]=False
+    start=(duration * gaps / gaps[last][pixel])[hit]
+    pixel=pixel[hit]
+    stop=start + 25e-9 * rng.uniform(0, max_tot, size=len(start))
+    
+    hits=np.empty(len(start), dtype=raw_dtype)
+    hits['x'], hits['y'], hits['start'], hits['stop'] = x_pix[pixel], y_pix[pixel], start, stop
+    
+    return hits
+
+
+# generate hits at a given flux (see "gen_rate_hits()") and compare the rate of accepted hits to the 
+# offered rate on each pixel, e.g. to find the flux at which hit losses due to dead time set in:
+#        ARGUMENTS:   - rate, duration, max_tot: see "gen_rate_hits()"
+#                     - op_mode=0/1: ToA & ToT Mode (=0) or ToA Only Mode (=1) 
+#                     - seed: random seed (default: random)
+#
+#        RETURNS:     - dictionary with the offered and accepted rates of each pixel in hits per 
+#                       second ('offered', 'accepted'; 256x256 arrays indexed [y, x]) and the 
+#                       fraction of all hits that was accepted ('fraction')
+
+def simulate_rate(rate, duration, op_mode=0, seed=None, max_tot=1022):
+    
+    hits=gen_rate_hits(rate, duration, rd.default_rng(seed), max_tot)
+    
+    x=hits['x'].astype(np.int64)
+    y=hits['y'].astype(np.int64)
+    accepted=accept_hits(xy_to_addr(x, y), hits['start'], hits['stop'], op_mode)
+    
+    # count hits on each pixel
+    pix=x + 256*y
+    offered=np.bincount(pix, minlength=2**16).reshape(256,256) / duration
+    kept=np.bincount(pix[accepted], minlength=2**16).reshape(256,256) / duration
+    
+    report={'offered': offered, 'accepted': kept, 'fraction': accepted.mean() if len(accepted) else 1.0}
+    
+    return report
+
 
 # generate N random hits, process (ToA & ToT Mode or ToA Only Mode) and packets to binary file; write 
 # corresponding decoded pixel counter values to csv file for reference 
@@ -158,64 +245,305 @@ def gen_phys_hits(N):
 #                     - op_mode=0/1: ToA & ToT Mode (=0) or ToA Only Mode (=1) 
 #                     - bin_name: filename of binary file
 #                     - csv_name: filename of csv file
+#                     - rng: numpy random Generator (see "gen_hits()"); if given, all hits are 
+#                            generated from it in a single process
+#                     - seed: random seed (default: random)
+#                     - workers: number of worker processes
+#                     - shard_size: number of particles per shard
+#                     - merge=True/False: write one time-sorted file (=True) or one file per shard 
+#                                         (=False, see "shard_file_name()")
+#
+#        NOTE:  - the N particles are split into shards of "shard_size" particles, each generated from 
+#                 its own child stream of the seed ("SeedSequence.spawn()"), so that the output only 
+#                 depends on the seed and "shard_size", NOT on the number of workers
+#               - when merging, hits of all shards are processed together, so that the dead time of 
+#                 pixels applies across shards; shard files are processed independently
 
-def simulate(N, op_mode=0, bin_name='packets.bin', csv_name='values.csv'):
+def simulate(N, op_mode=0, bin_name='packets.bin', csv_name='values.csv', rng=None, seed=None, workers=1, shard_size=2**16, merge=True):
+    
+    # single random stream
+    if rng is not None:
+        hits=gen_phys_hits(N, rng)
+        raw_to_file(bin_name, hits, op_mode)
+        file_to_df(bin_name,op_mode, decode=1, save=1, name=csv_name)
+        return 0
+    
+    # split particles into shards with independent random streams
+    n_shards=max(1, -(-N // shard_size))
+    sizes=np.diff(np.linspace(0, N, n_shards+1).astype(np.int64))
+    seeds=rd.SeedSequence(seed).spawn(n_shards)
+    
+    if merge:
+        args=[(n, child, op_mode, None, None) for n, child in zip(sizes, seeds)]
+    else:
+        args=[(n, child, op_mode, shard_file_name(bin_name, k), shard_file_name(csv_name, k)) for k, (n, child) in enumerate(zip(sizes, seeds))]
+    
+    # generate shards (in order, so that results do not depend on the number of workers)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results=list(pool.map(simulate_shard, args))
+    else:
+        results=[simulate_shard(arg) for arg in args]
     
-    # generate N hits
-    df=gen_phys_hits(N)
+    if not merge:
+        return 0
     
-    # pack and write to binary file
-    raw_to_file(bin_name, df,op_mode)
+    # merge shards, sort by start time and process all hits together
+    hits=np.concatenate(results)
+    hits=raw_hits(hits['x'], hits['y'], hits['start'], hits['stop'])
     
-    # save csv file with corresponding decoded pixel counter values for each hit
+    raw_to_file(bin_name, hits, op_mode)
     file_to_df(bin_name,op_mode, decode=1, save=1, name=csv_name)
     
     return 0
 
 
-# takes input file containing decoded pixel counter values and animates a GIF with the desired step size:
-#     (NOTE: input file must be csv with columns 'x', 'y', 'start', 'stop' ;
-#            thus, only works for decoded data in ToA & ToT Mode)
+# generate hits over an arbitrary duration as a stream of consecutive time windows:
+#        ARGUMENTS:   - N : number of detections per window
+#                     - duration: total time to simulate in seconds
+#                     - op_mode=0/1: ToA & ToT Mode (=0) or ToA Only Mode (=1) 
+#                     - window: length of each window in seconds (default: ToA range)
+#                     - rng: numpy random Generator (see "gen_hits()")
+#
+#        RETURNS:     - generator of processed hits (structured arrays of "hit_dtype", see "packing.py"),
+#                       one per window, each sorted by time and following the previous one in time
+#
+#        NOTE:  - tracks which start in one window but reach into the next are carried over and 
+#                 returned with the next window
+#               - the dead time of each pixel is carried over from window to window
+#               - only one window of hits is held in memory at a time
+
+def stream_hits(N, duration, op_mode=0, window=409.6e-6, rng=None):
+    
+    if rng is None:
+        rng=rd.default_rng()
+    
+    pixels=pixel_state()
+    carry=raw_hits([], [], [], [])
+    
+    for t_min in np.arange(0, duration, window):
+        
+        # last window may be shorter (fewer detections)
+        t_max=min(t_min + window, duration)
+        n=int(round(N * (t_max - t_min) / window))
+        
+        hits=gen_phys_hits(n, rng, t_min, t_max)
+        hits=np.concatenate([carry, hits])
+        hits=raw_hits(hits['x'], hits['y'], hits['start'], hits['stop'])
+        
+        # keep hits starting after the end of the window for the next one
+        if t_max < duration:
+            split=np.searchsorted(hits['start'], t_max)
+            hits, carry = hits[:split], hits[split:]
+        
+        yield raw_to_unpacked(hits, op_mode, pixels)
+
+
+# generate hits over an arbitrary duration (see "stream_hits()") and append the packets of each 
+# window to a binary file as soon as it has been generated:
+#        ARGUMENTS:   - N, duration, op_mode, window: see "stream_hits()"
+#                     - bin_name: filename of binary file
+#                     - seed: random seed (default: random)
+#
+#        RETURNS:     - number of packets written
+
+def simulate_stream(N, duration, op_mode=0, bin_name='packets.bin', window=409.6e-6, seed=None):
+    
+    # start with an empty file
+    open(bin_name, 'wb').close()
+    
+    count=0
+    for hits in stream_hits(N, duration, op_mode, window, rd.default_rng(seed)):
+        values_to_file(hits, bin_name, op_mode, append=True)
+        count += len(hits)
+    
+    return count
+
+
+# active pixels at each of a series of points in time:
+#     ARGUMENTS: - x, y, start, stop: pixel coordinates and timing data of the hits
+#                - times: sorted points in time (one per frame)
+#
+#     RETURNS:   - generator of 256x256 arrays (indexed [x, y]), 1 for pixels with a hit active 
+#                  (start <= t <= stop) at the time of the frame, 0 otherwise
+#
+#     NOTE: each hit is active in a contiguous range of frames, found by a binary search of its start 
+#           and stop time in "times"; a count of active hits per pixel is updated by the hits that 
+#           begin and end at each frame, so the cost does not grow with frames x hits
+
+def active_frames(x, y, start, stop, times):
+    
+    pix=256*np.asarray(x, dtype=np.int64) + np.asarray(y, dtype=np.int64)
+    times=np.asarray(times, dtype=np.float64)
+    
+    # first frame at which each hit is active and first frame after it
+    first=np.searchsorted(times, np.asarray(start, dtype=np.float64), side='left')
+    after=np.searchsorted(times, np.asarray(stop, dtype=np.float64), side='right')
+    active=first < after
+    pix, first, after = pix[active], first[active], after[active]
+    
+    # group hits by the frame at which they begin and end
+    begin=np.argsort(first, kind='stable')
+    end=np.argsort(after, kind='stable')
+    begin_bounds=np.searchsorted(first[begin], np.arange(len(times)+1))
+    end_bounds=np.searchsorted(after[end], np.arange(len(times)+1))
+    
+    count=np.zeros(2**16, dtype=np.int64)
+    for i in np.arange(len(times)):
+        count += np.bincount(pix[begin[begin_bounds[i]:begin_bounds[i+1]]], minlength=2**16)
+        count -= np.bincount(pix[end[end_bounds[i]:end_bounds[i+1]]], minlength=2**16)
+        yield (count > 0).astype(np.float64).reshape(256,256)
+
+
+# pixel coordinates and timing data (x, y, start, stop) of hits from any of:
+#     - a binary output file (".bin"): packets are read through a memory map and only x, y, start and 
+#       stop are decoded (see "file_to_table()" in "table.py")
+#     - a cache file of decoded columns (".npz", see "cache.py")
+#     - a csv file with columns 'x', 'y', 'start', 'stop' (e.g. "values.csv" written by "simulate()")
+#     - a "HitTable", DataFrame, dictionary of columns or structured array
+#    (op_mode: operation mode of binary files; in ToA Only Mode hits have no length, i.e. stop = start)
+
+def hit_columns(source, op_mode=0):
+    
+    if isinstance(source, str):
+        if source.endswith('.bin'):
+            source=file_to_table(source, op_mode)
+        elif source.endswith('.npz'):
+            with np.load(source) as data:
+                source={name: data[name] for name in ['x', 'y', 'start', 'stop'] if name in data.files}
+        else:
+            source=pd.read_csv(source)
+    
+    if isinstance(source, HitTable):
+        return source.x, source.y, source.start, source.stop
+    
+    start=np.asarray(source['start'])
+    stop=np.asarray(source['stop']) if 'stop' in column_names(source) else start
+    
+    return np.asarray(source['x']), np.asarray(source['y']), start, stop
 
-def visualise(steps, in_file='./input/values.csv', out_file='./output/timepix_simulations.gif'):
+
+# column names of a DataFrame, dictionary of columns or structured array
+
+def column_names(source):
+    
+    if isinstance(source, np.ndarray):
+        return source.dtype.names
+    
+    return list(source.keys())
+
+
+# set up the figure of the animation: returns figure, image and text artists, which are updated
+# for each frame (see "visualise()")
+
+def frame_figure():
+    
+    fig = plt.figure(figsize=[10,10])
+    
+    plt.title("Timepix3 pixel array", fontsize=30)
+    text=plt.text(20,0, '', fontsize=18, ha="center",va="bottom")
+    image=plt.imshow(np.zeros((256,256)), cmap="hot", vmin=0, vmax=1)
+    plt.axis('off')
+    plt.xticks([])
+    plt.yticks([])
+    
+    return fig, image, text
+
+
+# render frames of the animation into RGBA arrays (worker function for "visualise()")
+
+def render_frames(args):
+    
+    x, y, start, stop, times = args
+    
+    fig, image, text = frame_figure()
+    
+    frames=[]
+    for i, data in zip(times, active_frames(x, y, start, stop, times)):
+        image.set_data(data)
+        text.set_text('t={0:.3e}'.format(i))
+        fig.canvas.draw()
+        frames.append(np.asarray(fig.canvas.buffer_rgba()).copy())
+    
+    plt.close(fig)
+    
+    return frames
+
+
+# writer for the animation file: frames are piped to ffmpeg as they are rendered (if available, for 
+# any format supported by ffmpeg, e.g. GIF or MP4); otherwise GIF files are written with Pillow
+
+def movie_writer(out_file, fps):
+    
+    if animation.writers.is_available('ffmpeg'):
+        return animation.FFMpegWriter(fps=fps)
+    
+    if out_file.endswith('.gif'):
+        return animation.PillowWriter(fps=fps)
+    
+    raise ValueError('ffmpeg is required to write {0}'.format(out_file))
+
+
+# takes hit data (e.g. a file containing decoded pixel counter values) and animates a GIF with the desired 
+# step size:
+#     (NOTE: only hits with start and stop time, i.e. data in ToA & ToT Mode, are visible)
+#
+#        ARGUMENTS:   - steps: number of frames
+#                     - in_file: binary output file, cache file, csv file or hit data in memory (see 
+#                                "hit_columns()")
+#                     - out_file: output animation (e.g. ".gif" or ".mp4")
+#                     - fps: frames per second of the animation
+#                     - workers: number of worker processes rendering frames (default: 1, no workers)
+#                     - block: number of consecutive frames rendered by a worker at a time
+#                     - op_mode: operation mode of binary input files
+#                     - max_bytes: memory for frames rendered by workers and not yet written; "block" 
+#                                  is reduced so that "workers" blocks of frames (~4 MB each) fit into it
+#
+#        A single figure is set up and only its image and text are updated for each frame; frames are 
+#        passed on to the writer as soon as they are rendered. With ffmpeg (see "movie_writer()") 
+#        memory therefore does not grow with the number of steps. WITHOUT FFMPEG, GIF FILES ARE WRITTEN
+#        WITH PILLOW, WHICH KEEPS EVERY FRAME IN MEMORY UNTIL THE FILE IS WRITTEN (~4 MB PER STEP).
+
+def visualise(steps, in_file='./input/values.csv', out_file='./output/timepix_simulations.gif', fps=5, workers=1, block=50, op_mode=0, max_bytes=2**30):
     
     # read input data 
-    df=pd.read_csv(in_file)
+    x, y, start, stop = hit_columns(in_file, op_mode)
     
     # define time range and number of steps in the animation
     time=np.linspace(0, 409.6e-6, steps)
     
-    # set up animation
-    fig = plt.figure(figsize=[10,10])
-    camera = Camera(fig)
+    writer=movie_writer(out_file, fps)
     
-    # animate heatmap
-    for i in time:
-        
-        # set up empty pixel grid
-        data=np.zeros( (256,256)) 
+    # render frames in this process: update artists of one figure and pass each frame to the writer
+    if workers <= 1:
         
-        # set active pixels to 1
-        for j in np.arange(len(df['start'])):
-            x=df['x'].iloc[j]
-            y=df['y'].iloc[j]
-            if (df['start'].iloc[j] <= i) & (df['stop'].iloc[j] >= i):
-                data[x][y]=1
+        fig, image, text = frame_figure()
+        with writer.saving(fig, out_file, fig.dpi):
+            for i, data in zip(time, active_frames(x, y, start, stop, time)):
+                image.set_data(data)
+                text.set_text('t={0:.3e}'.format(i))
+                writer.grab_frame()
+        plt.close(fig)
         
-        # plot pixel array
-        plt.title("Timepix3 pixel array", fontsize=30)
-        plt.text(20,0, 't={0:.3e}'.format(i), animated=True, fontsize=18, ha="center",va="bottom")
-        plt.imshow(data, cmap="hot")
-        plt.axis('off')
-        plt.xticks([])
-        plt.yticks([])
-        
-        # take a snap shot to animate
-        camera.snap()
+        return 0
+    
+    # render blocks of frames in worker processes; blocks are written in order, "workers" blocks at a time
+    # (at most "max_bytes" of RGBA frames are held at once)
+    dpi=plt.rcParams['figure.dpi']
+    frame_bytes=4 * (10*int(dpi))**2
+    block=int(max(1, min(block, max_bytes // (workers*frame_bytes))))
+    blocks=[time[k:k+block] for k in np.arange(0, steps, block)]
     
+    fig=plt.figure(figsize=[10,10], dpi=dpi)
+    image=fig.figimage(np.zeros((10*int(dpi), 10*int(dpi), 4), dtype=np.uint8))
     
-    # render and save animation
-    animation = camera.animate()
-    animation.save(out_file)
+    with ProcessPoolExecutor(max_workers=workers) as pool, writer.saving(fig, out_file, dpi):
+        for k in np.arange(0, len(blocks), workers):
+            args=[(x, y, start, stop, times) for times in blocks[k:k+workers]]
+            for frames in pool.map(render_frames, args):
+                for frame in frames:
+                    image.set_data(frame)
+                    writer.grab_frame()
+    plt.close(fig)
     
-    return 0
\ No newline at end of file
+    return 0
@@ -0,0 +1,110 @@
+#  ------------------------------------------------------------------------------------------
+#  "validation.py" - Contains functions to check binary output files for corrupted or
+#                    misaligned packets before decoding them
+#  ------------------------------------------------------------------------------------------
+#
+#  The decoding functions in "packing.py" do not check the contents of the 48-bit packets:
+#  the header nibble (0b1010) is ignored and invalid LFSR codes are decoded to 0 by
+#  "counter_decode()". Corrupted or misaligned files therefore decode into plausible-looking
+#  data.
+#
+#
+#  The function "validate_packets()" checks a binary output file in a single pass over the
+#  memory-mapped packets, using whole-array operations only, and returns a report (dictionary)
+#  with the number of:
+#         - packets with a header other than 0b1010
+#         - packets with a ToT code that can not be produced by the ToT LFSR (ToA & ToT Mode)
+#         - packets with a pixel address outside of the pixel matrix
+#         - steps backwards in the (decoded) ToA timestamp between consecutive packets
+#  Misalignment of the packets (e.g. due to missing or additional bytes at the start of the file)
+#  is detected from the periodicity of the header nibble with "header_alignment()".
+#
+#
+#  Note that the 16-bit address field covers exactly the 256*256 pixels of a single chip, so
+#  out-of-range addresses can only occur if a smaller pixel matrix ("xPix", "yPix") is specified.
+#
+#
+#  This file requires numpy as well as functions from "counters.py" and "packing.py".
+
+
+# import modules
+import numpy as np
+from os.path import getsize
+from timepix3.counters import counter_decode_array
+from timepix3.packing import memmap_packets, bytes_to_packets, unpack_001, addr_to_xy
+
+
+# determine the fraction of 6-byte records that start with the packet header for each of the
+# 6 possible byte offsets:
+#    (returns array of 6 fractions; for a correctly aligned file the fraction at offset 0 is 1)
+
+def header_alignment(data, header=0b1010):
+
+    data=np.asarray(data, dtype=np.uint8).ravel()
+
+    fractions=np.zeros(6)
+    for k in np.arange(6):
+        n=(len(data)-k)//6
+        if n > 0:
+            first=data[k:k+6*n:6]
+            fractions[k]=np.mean((first >> 4) == header)
+
+    return fractions
+
+
+# check binary output file for corrupted or misaligned packets:
+#
+# ARGUMENTS:      - op_mode=0/1: ToA & ToT Mode (=0) or ToA Only Mode (=1)
+#                 - chunk_size: number of packets checked at a time (limits memory use)
+#                 - sample_size: number of packets used to test the header periodicity
+#                 - tolerance: fraction of bad packets up to which the file is still marked valid
+#                 - xPix, yPix: dimensions of the pixel matrix
+#
+# RETURNS:        - dictionary with the number of packets, trailing bytes, packet counts for each
+#                   type of error (see header comment), the alignment fractions, the most likely
+#                   byte offset of the packets and whether the file is considered valid
+
+def validate_packets(file, op_mode=0, chunk_size=2**22, sample_size=2**16, tolerance=0, xPix=256, yPix=256):
+
+    # set up report
+    size=getsize(file)
+    report={'n_packets': size//6, 'trailing_bytes': size%6, 'bad_header': 0, 'bad_lfsr': 0,
+            'bad_addr': 0, 'toa_backwards': 0, 'toa_wraps': 0}
+
+    # test header periodicity on the start of the file
+    raw=memmap_packets(file, 0, sample_size)
+    report['alignment']=header_alignment(raw)
+    report['offset']=int(np.argmax(report['alignment'])) if len(raw) else 0
+
+    # ToA range; a step backwards by more than half the range is counted as a wrap of the counter
+    toa_range=2**14
+    prev_toa=-1
+
+    # loop through file in chunks of packets
+    for offset in np.arange(0, report['n_packets'], chunk_size):
+
+        packets=bytes_to_packets(memmap_packets(file, offset, chunk_size))
+
+        # unpack fields (the ToT field holds the 10-bit dummy in ToA Only Mode)
+        header,addr,toa,tot,ftoa = unpack_001(packets)
+
+        report['bad_header'] += int(np.count_nonzero(header != 0b1010))
+
+        if op_mode==0:
+            report['bad_lfsr'] += int(np.count_nonzero(counter_decode_array(tot, 'tot', sentinel=True) < 0))
+
+        x,y = addr_to_xy(addr)
+        report['bad_addr'] += int(np.count_nonzero((x >= xPix) | (y >= yPix)))
+
+        # compare each ToA with that of the previous packet (including the end of the last chunk)
+        toa=counter_decode_array(toa, 'toa')
+        dtoa=np.diff(toa, prepend=toa[0] if prev_toa < 0 else prev_toa)
+        report['toa_wraps'] += int(np.count_nonzero(dtoa < -toa_range//2))
+        report['toa_backwards'] += int(np.count_nonzero((dtoa < 0) & (dtoa >= -toa_range//2)))
+        prev_toa=toa[-1]
+
+    # decide whether file is valid
+    n_bad=report['bad_header'] + report['bad_lfsr'] + report['bad_addr'] + report['toa_backwards']
+    report['valid']= bool((report['offset']==0) & (report['trailing_bytes']==0) & (n_bad <= tolerance*report['n_packets']))
+
+    return report
@@ -0,0 +1,222 @@
+#  ------------------------------------------------------------------------------------------
+#  "benchmark.py" - Contains an end-to-end benchmark of the simulation and decoding pipeline
+#  ------------------------------------------------------------------------------------------
+#
+#  The benchmark runs the stages of the pipeline one after the other for a range of sizes N
+#  (number of simulated detections) with a fixed random seed:
+#         - 'simulate':         "gen_phys_hits()" in "generate.py"
+#         - 'raw_to_unpacked':  "raw_to_unpacked()" in "packing.py"
+#         - 'values_to_file':   "values_to_file()" in "packing.py"
+#         - 'file_to_packets':  "file_to_packets()" in "packing.py"
+#         - 'file_to_df':       "file_to_df()" in "packing.py"
+#  and records the wall time and the peak memory allocated (measured with tracemalloc) of each
+#  stage. Every stage is run twice: the wall time is taken from an untraced run and the memory
+#  from a second, traced run, as tracing slows the stage down. Results are written to a JSON file
+#  and plotted against N, together with the baseline file if there is one.
+#
+#
+#  The baseline holds absolute wall times of the machine it was recorded on. With "--check",
+#  every stage is compared to the baseline at the same N and slower stages are reported; this is
+#  only meaningful on the same machine (re-record the baseline with "--save-baseline" first).
+#
+#
+#  Usage (from the "simulation" directory):
+#
+#        python benchmark.py                                   # N = 1e2 ... 1e6
+#        python benchmark.py --sizes 100 10000 --plot bench.png
+#        python benchmark.py --save-baseline                   # update "benchmark_baseline.json"
+#        python benchmark.py --check                           # compare to the baseline
+#
+#  With "--check", the script exits with status 1 if any stage is slower than "tolerance" times
+#  the baseline.
+#
+#
+#  This file requires numpy and matplotlib as well as functions from "generate.py" and
+#  "packing.py".
+
+
+# import modules
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from generate import gen_phys_hits
+from packing import raw_to_unpacked, values_to_file, file_to_packets, file_to_df
+
+
+# names of the benchmarked stages, in order
+stages=['simulate', 'raw_to_unpacked', 'values_to_file', 'file_to_packets', 'file_to_df']
+
+# default sizes and baseline file
+#    (N = 1e7 needs more memory than most machines have: the simulation alone allocates ~20 GB)
+default_sizes=[10**k for k in np.arange(2, 7)]
+default_baseline=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+
+# run a function and return its result, the wall time in seconds and the peak memory in bytes
+# allocated while it ran:
+#    (the function is run twice, once timed and once traced, and must give the same result for
+#     the same arguments)
+
+def measure(func, *args):
+
+    t_0=time.perf_counter()
+    result=func(*args)
+    wall=time.perf_counter() - t_0
+
+    tracemalloc.start()
+    func(*args)
+    current, peak=tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, wall, peak
+
+
+# simulation stage: generator seeded anew on every call, so that both runs of "measure()" are equal
+
+def simulate_stage(N, seed):
+    return gen_phys_hits(N, np.random.default_rng(seed))
+
+
+# run all stages of the pipeline for each size:
+#
+# ARGUMENTS:      - sizes: list of numbers of detections N
+#                 - op_mode=0/1: ToA & ToT Mode (=0) or ToA Only Mode (=1)
+#                 - seed: random seed (the same for every size)
+#
+# RETURNS:        - dictionary with information on the machine ('meta') and one record per size and
+#                   stage ('results': N, number of hits, stage, wall time, peak memory)
+
+def run_benchmark(sizes=default_sizes, op_mode=0, seed=0):
+
+    records=[]
+
+    with tempfile.TemporaryDirectory() as directory:
+        file=os.path.join(directory, 'packets.bin')
+
+        for N in sizes:
+
+            raw, t_sim, m_sim=measure(simulate_stage, int(N), seed)
+            hits, t_unp, m_unp=measure(raw_to_unpacked, raw, op_mode)
+            _, t_val, m_val=measure(values_to_file, hits, file, op_mode)
+            _, t_pac, m_pac=measure(file_to_packets, file)
+            _, t_df, m_df=measure(file_to_df, file, op_mode)
+
+            for stage, wall, peak in zip(stages, [t_sim, t_unp, t_val, t_pac, t_df], [m_sim, m_unp, m_val, m_pac, m_df]):
+                records.append({'N': int(N), 'hits': int(len(hits)), 'stage': stage, 'time': wall, 'peak_bytes': int(peak)})
+
+            del raw, hits
+
+    meta={'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+          'processor': platform.processor(), 'op_mode': op_mode, 'seed': seed}
+
+    return {'meta': meta, 'results': records}
+
+
+# compare results to a baseline:
+#    (returns a list of (stage, N, time, baseline time) for every stage that is slower than
+#     "tolerance" times the baseline at the same N; differences below "min_time" seconds are
+#     ignored, as very short stages are dominated by timing noise)
+
+def compare(results, baseline, tolerance=1.5, min_time=1e-2):
+
+    reference={(record['stage'], record['N']): record['time'] for record in baseline['results']}
+
+    slower=[]
+    for record in results['results']:
+        key=(record['stage'], record['N'])
+        if (key in reference) and (record['time'] > tolerance * reference[key]) and (record['time'] - reference[key] > min_time):
+            slower.append((record['stage'], record['N'], record['time'], reference[key]))
+
+    return slower
+
+
+# plot wall time and peak memory of each stage against N (baseline as dashed lines)
+
+def plot(results, file, baseline=None):
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, axes=plt.subplots(1, 2, figsize=[14,6])
+
+    for k, stage in enumerate(stages):
+        colour='C{0}'.format(k)
+        for data, style, label in [(results, '-o', stage), (baseline, '--', None)]:
+            if data is None:
+                continue
+            records=[record for record in data['results'] if record['stage']==stage]
+            N=[record['N'] for record in records]
+            axes[0].plot(N, [record['time'] for record in records], style, color=colour, label=label)
+            axes[1].plot(N, [record['peak_bytes'] / 2**20 for record in records], style, color=colour, label=label)
+
+    for ax, ylabel in zip(axes, ['wall time [s]', 'peak memory [MiB]']):
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        ax.set_xlabel('number of detections N')
+        ax.set_ylabel(ylabel)
+        ax.grid(True, which='both', alpha=0.3)
+    axes[0].legend()
+
+    fig.tight_layout()
+    fig.savefig(file)
+    plt.close(fig)
+
+    return 0
+
+
+# command line interface (see header comment)
+
+def main(argv=None):
+
+    parser=argparse.ArgumentParser(description='Benchmark the Timepix3 simulation and decoding pipeline.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes, help='numbers of detections N')
+    parser.add_argument('--op-mode', type=int, default=0, choices=[0, 1], help='0: ToA & ToT Mode, 1: ToA Only Mode')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file for the results')
+    parser.add_argument('--plot', default='benchmark.png', help='image file for the plot (empty: no plot)')
+    parser.add_argument('--baseline', default=default_baseline, help='JSON file with baseline results')
+    parser.add_argument('--check', action='store_true', help='compare wall times to the baseline (same machine only)')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed slow-down relative to the baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to the baseline file')
+    args=parser.parse_args(argv)
+
+    results=run_benchmark(args.sizes, args.op_mode, args.seed)
+
+    for record in results['results']:
+        print('N={N:>9d}  hits={hits:>10d}  {stage:<16s} {time:10.4f} s  {peak:10.1f} MiB'.format(peak=record['peak_bytes'] / 2**20, **record))
+
+    with open(args.output, 'w') as dfile:
+        json.dump(results, dfile, indent=1)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as dfile:
+            json.dump(results, dfile, indent=1)
+        baseline=None
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as dfile:
+            baseline=json.load(dfile)
+    else:
+        baseline=None
+
+    if args.plot:
+        plot(results, args.plot, baseline)
+
+    if (baseline is None) or (not args.check):
+        return 0
+
+    slower=compare(results, baseline, args.tolerance)
+    for stage, N, wall, reference in slower:
+        print('SLOWER: {0} at N={1}: {2:.4f} s (baseline {3:.4f} s)'.format(stage, N, wall, reference))
+
+    return 1 if slower else 0
+
+
+if __name__=='__main__':
+    sys.exit(main())
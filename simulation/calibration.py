@@ -0,0 +1,141 @@
+#  ------------------------------------------------------------------------------------------
+#  "calibration.py" - Contains functions to convert ToT to energy and to correct hit times
+#                     for time-walk, using per-pixel calibration parameters
+#  ------------------------------------------------------------------------------------------
+#
+#  The ToT of a hit depends non-linearly on the deposited energy E. Per pixel, this is
+#  described by the surrogate function
+#
+#                  ToT = a*E + b - c / (E - t)
+#
+#  with calibration parameters a, b, c, t. Low-energy hits also cross the threshold later than
+#  high-energy ones (time-walk); the delay is modelled per pixel as
+#
+#                  walk = walk_c / (E - walk_t)         (in seconds)
+#
+#  and subtracted from the hit time.
+#
+#
+#  The parameters are stored as one 256 x 256 array per parameter (indexed [y, x], so that the
+#  flattened arrays are indexed by the pixel index x + 256*y, as in "histograms.py"), saved as
+#  ".npy" files in a calibration directory ("save_calibration()"). "load_calibration()" maps them
+#  into memory without reading them and "apply_calibration()" converts a whole chunk of hits with
+#  one gather per parameter plus array arithmetic. Calibration can be applied directly when
+#  decoding with "file_to_df()" or "file_to_chunks()" in "packing.py" (argument "calib").
+#
+#
+#  Calibration requires ToT data, i.e. ToA & ToT Mode (op_mode=0).
+#
+#
+#  This file requires numpy as well as functions from "counters.py".
+
+
+# import modules
+import numpy as np
+import os
+from counters import counter_decode_array
+
+
+# names of the calibration parameters (one ".npy" file each)
+calib_names=['a', 'b', 'c', 't', 'walk_c', 'walk_t']
+
+
+# set up calibration with the same parameters for every pixel:
+#    (default values give energies in keV for typical Timepix3 calibrations; no time-walk correction)
+
+def new_calibration(a=1.6, b=25.0, c=300.0, t=1.0, walk_c=0.0, walk_t=0.0):
+
+    values={'a': a, 'b': b, 'c': c, 't': t, 'walk_c': walk_c, 'walk_t': walk_t}
+
+    return {name: np.full((256,256), values[name], dtype=np.float64) for name in calib_names}
+
+
+# save calibration parameters to a directory (one ".npy" file per parameter)
+
+def save_calibration(calib, directory):
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    for name in calib_names:
+        np.save(os.path.join(directory, name + '.npy'), np.asarray(calib[name], dtype=np.float64))
+
+    return 0
+
+
+# load calibration parameters from a directory:
+#    (files are memory-mapped; missing time-walk parameters are set to 0, i.e. no correction)
+
+def load_calibration(directory):
+
+    calib={}
+    for name in calib_names:
+        file=os.path.join(directory, name + '.npy')
+        if os.path.exists(file):
+            calib[name]=np.load(file, mmap_mode='r')
+        elif name in ['walk_c', 'walk_t']:
+            calib[name]=np.zeros((256,256))
+        else:
+            raise FileNotFoundError('calibration parameter file {0} is missing'.format(file))
+
+    return calib
+
+
+# convert ToT to energy for hits on the given pixels (inverse of the surrogate function above):
+#    (tot: DECODED ToT values)
+
+def tot_to_energy(x, y, tot, calib):
+
+    pix=np.asarray(x, dtype=np.int64) + 256*np.asarray(y, dtype=np.int64)
+    tot=np.asarray(tot, dtype=np.float64)
+
+    # gather parameters of each hit's pixel
+    a=np.asarray(calib['a']).reshape(-1)[pix]
+    b=np.asarray(calib['b']).reshape(-1)[pix]
+    c=np.asarray(calib['c']).reshape(-1)[pix]
+    t=np.asarray(calib['t']).reshape(-1)[pix]
+
+    # larger root of  a*E^2 + (b - a*t - ToT)*E + (ToT*t - b*t - c) = 0
+    p=a*t + tot - b
+    energy=(p + np.sqrt(np.maximum((b + a*t - tot)**2 + 4*a*c, 0))) / (2*a)
+
+    return energy
+
+
+# time-walk of hits with the given energies on the given pixels (in seconds)
+
+def time_walk(x, y, energy, calib):
+
+    pix=np.asarray(x, dtype=np.int64) + 256*np.asarray(y, dtype=np.int64)
+
+    walk_c=np.asarray(calib['walk_c']).reshape(-1)[pix]
+    walk_t=np.asarray(calib['walk_t']).reshape(-1)[pix]
+
+    # no correction below the asymptote of the walk function
+    with np.errstate(invalid='ignore', divide='ignore'):
+        walk=np.where(energy > walk_t, walk_c / (energy - walk_t), 0)
+
+    return walk
+
+
+# add calibrated columns to decoded hit data (dictionary of columns or DataFrame with columns
+# 'x', 'y', 'tot' and the time column(s)):
+#     - 'energy': deposited energy of each hit
+#     - 'start_corr' / 'time_corr': hit times ('start' / 'time') corrected for time-walk
+#    (decode=0 if the 'tot' column holds ENCODED values; columns are added in place)
+
+def apply_calibration(columns, calib, decode=1):
+
+    tot=np.asarray(columns['tot'])
+    if not decode:
+        tot=counter_decode_array(tot, 'tot')
+
+    energy=tot_to_energy(columns['x'], columns['y'], tot, calib)
+    walk=time_walk(columns['x'], columns['y'], energy, calib)
+
+    columns['energy']=energy
+    for name in ['start', 'time']:
+        if name in columns:
+            columns[name + '_corr']=np.asarray(columns[name]) - walk
+
+    return columns
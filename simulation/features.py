@@ -0,0 +1,100 @@
+#  ------------------------------------------------------------------------------------------
+#  "features.py" - Contains functions to compute the features of each cluster of hits
+#  ------------------------------------------------------------------------------------------
+#
+#  Once hits carry cluster labels (see "clustering.py"), the function "cluster_features()"
+#  computes for each cluster:
+#         - 'n_pix': number of hits (pixels)
+#         - 'x', 'y': centroid, weighted by the ToT of each hit (unweighted if no ToT is given,
+#                     e.g. in ToA Only Mode)
+#         - 'x_min', 'x_max', 'y_min', 'y_max': bounding box
+#         - 'tot_sum': summed (decoded) ToT
+#         - 't_first': time of the first hit
+#         - 't_spread': time between first and last hit
+#  The hits are sorted by label once and all features are computed with segmented reductions
+#  ("np.add.reduceat", "np.minimum.reduceat", "np.maximum.reduceat") over the sorted arrays.
+#  The result is a numpy structured array with one row per cluster (dtype "feature_dtype").
+#
+#
+#  The generator "chunk_features()" does the same for each chunk returned by
+#  "cluster_chunks()" in "clustering.py" (clusters are never split between those chunks).
+#
+#
+#  This file requires numpy.
+
+
+# import modules
+import numpy as np
+
+
+# structure of the output array
+feature_dtype=np.dtype([('cluster', np.int64), ('n_pix', np.int32), ('x', np.float32), ('y', np.float32),
+                        ('x_min', np.uint16), ('x_max', np.uint16), ('y_min', np.uint16), ('y_max', np.uint16),
+                        ('tot_sum', np.int64), ('t_first', np.float64), ('t_spread', np.float64)])
+
+
+# compute features of each cluster:
+#
+# ARGUMENTS:      - cluster: cluster label of each hit
+#                 - x, y: pixel coordinates of each hit
+#                 - t: time of each hit in seconds
+#                 - tot: decoded ToT of each hit (optional)
+#
+# RETURNS:        - structured array (dtype "feature_dtype") with one row per cluster, sorted by label
+
+def cluster_features(cluster, x, y, t, tot=None):
+
+    cluster=np.asarray(cluster)
+    if len(cluster)==0:
+        return np.zeros(0, dtype=feature_dtype)
+
+    # sort hits by label (skipped if already sorted, e.g. for output of "cluster_chunks()")
+    if (np.diff(cluster) >= 0).all():
+        order=slice(None)
+    else:
+        order=np.argsort(cluster, kind='stable')
+
+    cluster=cluster[order]
+    x=np.asarray(x, dtype=np.int64)[order]
+    y=np.asarray(y, dtype=np.int64)[order]
+    t=np.asarray(t, dtype=np.float64)[order]
+    w=np.ones(len(x)) if tot is None else np.asarray(tot, dtype=np.float64)[order]
+
+    # start index of each cluster in the sorted arrays
+    starts=np.flatnonzero(np.diff(cluster, prepend=cluster[0]-1))
+
+    out=np.zeros(len(starts), dtype=feature_dtype)
+    out['cluster']=cluster[starts]
+    out['n_pix']=np.diff(np.append(starts, len(cluster)))
+
+    # ToT-weighted centroid (unweighted where the summed ToT is 0)
+    w_sum=np.add.reduceat(w, starts)
+    no_weight=(w_sum==0)
+    if no_weight.any():
+        w=np.where(no_weight[np.repeat(np.arange(len(starts)), out['n_pix'])], 1, w)
+        w_sum=np.add.reduceat(w, starts)
+    out['x']=np.add.reduceat(w*x, starts) / w_sum
+    out['y']=np.add.reduceat(w*y, starts) / w_sum
+
+    # bounding box
+    out['x_min']=np.minimum.reduceat(x, starts)
+    out['x_max']=np.maximum.reduceat(x, starts)
+    out['y_min']=np.minimum.reduceat(y, starts)
+    out['y_max']=np.maximum.reduceat(y, starts)
+
+    # summed ToT and timing
+    if tot is not None:
+        out['tot_sum']=np.add.reduceat(np.asarray(tot, dtype=np.int64)[order], starts)
+    out['t_first']=np.minimum.reduceat(t, starts)
+    out['t_spread']=np.maximum.reduceat(t, starts) - out['t_first']
+
+    return out
+
+
+# compute cluster features for each chunk of labelled hits (e.g. from "cluster_chunks()"):
+#    (generator of structured arrays; ToT is used if the chunks have a 'tot' column)
+
+def chunk_features(chunks, time_column='time'):
+
+    for chunk in chunks:
+        yield cluster_features(chunk['cluster'], chunk['x'], chunk['y'], chunk[time_column], chunk.get('tot'))
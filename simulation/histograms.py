@@ -0,0 +1,175 @@
+#  ------------------------------------------------------------------------------------------
+#  "histograms.py" - Contains functions to accumulate pixel occupancy and per-pixel ToT
+#                    histograms over decoded chunks of hit data
+#  ------------------------------------------------------------------------------------------
+#
+#  Hit maps and ToT spectra can be built without ever holding a full DataFrame of the data:
+#  the function "new_histograms()" sets up an (empty) set of histograms, "accumulate()" adds
+#  the hits of one decoded chunk (e.g. from "file_to_chunks()" in "packing.py") and
+#  "merge_histograms()" combines partial results, e.g. from parallel workers that each
+#  process part of a file.
+#
+#
+#  The histograms are stored in a dictionary with the following entries (pixels are indexed
+#  by x + 256*y, as in "equalisation.py"):
+#         - 'hits': number of hits on each pixel (65,536 entries)
+#         - 'tot_hist': ToT histogram of each pixel; either a dense 65,536 x 1024 uint32 array
+#                       or, if sparse=True, a dictionary with the (sorted) flat indices
+#                       x + 256*y + 65,536*ToT of the filled bins ('keys') and their contents
+#                       ('values'), which needs far less memory for short runs
+#         - 'tot_n', 'tot_mean', 'tot_m2': number of ToT values, running mean of the ToT and
+#                       sum of squared deviations from the mean for each pixel (Welford's method;
+#                       see "tot_variance()")
+#  All updates are done with whole-array operations ("np.bincount", "np.unique").
+#
+#
+#  The ToT histograms and statistics are only filled in ToA & ToT Mode (chunks with a 'tot'
+#  column) and require DECODED ToT values (decode=1).
+#
+#
+#  This file requires numpy.
+
+
+# import modules
+import numpy as np
+
+
+# number of pixels and ToT bins
+n_pix=256*256
+n_tot=1024
+
+
+# set up empty histograms
+#    (sparse=True: store only filled bins of the ToT histograms)
+
+def new_histograms(sparse=False):
+
+    hists={'hits': np.zeros(n_pix, dtype=np.int64),
+           'tot_n': np.zeros(n_pix, dtype=np.int64),
+           'tot_mean': np.zeros(n_pix),
+           'tot_m2': np.zeros(n_pix)}
+
+    if sparse:
+        hists['tot_hist']={'keys': np.zeros(0, dtype=np.int64), 'values': np.zeros(0, dtype=np.uint32)}
+    else:
+        hists['tot_hist']=np.zeros((n_pix, n_tot), dtype=np.uint32)
+
+    return hists
+
+
+# combine per-pixel ToT statistics (count, mean, sum of squared deviations) of two sets of
+# hits (Chan et al. pairwise update of Welford's method)
+
+def combine_stats(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+
+    n=n_a + n_b
+    delta=mean_b - mean_a
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac=np.where(n > 0, n_b / n, 0)
+    mean=mean_a + delta*frac
+    m2=m2_a + m2_b + delta**2 * n_a * frac
+
+    return n, mean, m2
+
+
+# add filled bins (flat indices "keys" with contents "values") to the ToT histograms
+
+def add_to_tot_hist(tot_hist, keys, values):
+
+    if isinstance(tot_hist, dict):
+        keys=np.concatenate([tot_hist['keys'], keys])
+        values=np.concatenate([tot_hist['values'], values])
+        tot_hist['keys'], inverse=np.unique(keys, return_inverse=True)
+        tot_hist['values']=np.bincount(inverse, weights=values).astype(np.uint32)
+    else:
+        # keys are unique, so the fancy-indexed addition is safe
+        flat=tot_hist.reshape(-1)
+        pix, tot = keys % n_pix, keys // n_pix
+        flat[pix*n_tot + tot] += values.astype(np.uint32)
+
+    return tot_hist
+
+
+# add the hits of one decoded chunk (dictionary or DataFrame with columns 'x', 'y' and, in
+# ToA & ToT Mode, 'tot') to the histograms:
+#    (histograms are updated in place and returned)
+
+def accumulate(hists, chunk):
+
+    pix=np.asarray(chunk['x'], dtype=np.int64) + 256*np.asarray(chunk['y'], dtype=np.int64)
+
+    # occupancy
+    hists['hits'] += np.bincount(pix, minlength=n_pix)
+
+    if ('tot' not in chunk) or (len(pix)==0):
+        return hists
+
+    tot=np.clip(np.asarray(chunk['tot'], dtype=np.int64), 0, n_tot-1)
+
+    # ToT histograms: count hits in each (pixel, ToT) bin of the chunk
+    keys, values=np.unique(pix + n_pix*tot, return_counts=True)
+    hists['tot_hist']=add_to_tot_hist(hists['tot_hist'], keys, values)
+
+    # ToT statistics of the chunk, then combine with previous chunks
+    n_b=np.bincount(pix, minlength=n_pix)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_b=np.where(n_b > 0, np.bincount(pix, weights=tot, minlength=n_pix) / n_b, 0)
+    m2_b=np.bincount(pix, weights=(tot - mean_b[pix])**2, minlength=n_pix)
+
+    hists['tot_n'], hists['tot_mean'], hists['tot_m2'] = combine_stats(hists['tot_n'], hists['tot_mean'], hists['tot_m2'], n_b, mean_b, m2_b)
+
+    return hists
+
+
+# merge two sets of histograms (e.g. partial results from parallel workers):
+#    (returns a new set of histograms; sparse if either input is sparse)
+
+def merge_histograms(a, b):
+
+    merged={'hits': a['hits'] + b['hits']}
+    merged['tot_n'], merged['tot_mean'], merged['tot_m2'] = combine_stats(a['tot_n'], a['tot_mean'], a['tot_m2'], b['tot_n'], b['tot_mean'], b['tot_m2'])
+
+    # dense histograms are simply added; otherwise the filled bins of both are combined
+    if isinstance(a['tot_hist'], dict) | isinstance(b['tot_hist'], dict):
+        merged['tot_hist']={'keys': np.zeros(0, dtype=np.int64), 'values': np.zeros(0, dtype=np.uint32)}
+        for hists in [a, b]:
+            keys, values=tot_hist_bins(hists['tot_hist'])
+            merged['tot_hist']=add_to_tot_hist(merged['tot_hist'], keys, values)
+    else:
+        merged['tot_hist']=a['tot_hist'] + b['tot_hist']
+
+    return merged
+
+
+# return flat indices and contents of the filled bins of the ToT histograms
+
+def tot_hist_bins(tot_hist):
+
+    if isinstance(tot_hist, dict):
+        return tot_hist['keys'], tot_hist['values']
+
+    pix, tot = np.nonzero(tot_hist)
+
+    return pix + n_pix*tot, tot_hist[pix, tot]
+
+
+# convert ToT histograms to a dense 65,536 x 1024 array
+
+def dense_tot_hist(hists):
+
+    if not isinstance(hists['tot_hist'], dict):
+        return hists['tot_hist']
+
+    tot_hist=np.zeros((n_pix, n_tot), dtype=np.uint32)
+    keys, values=tot_hist_bins(hists['tot_hist'])
+    tot_hist[keys % n_pix, keys // n_pix]=values
+
+    return tot_hist
+
+
+# return (sample) variance of the ToT on each pixel (NaN for pixels with fewer than two hits)
+
+def tot_variance(hists):
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(hists['tot_n'] > 1, hists['tot_m2'] / (hists['tot_n'] - 1), np.nan)
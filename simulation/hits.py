@@ -10,7 +10,8 @@
 #
 #
 #  This file provides functionality to convert discriminator pulses to pixel counter values
-#  for a series of hits ON THE SAME PIXEL. Each hit in the pulse is either accepted or
+#  for a series of hits ON THE SAME PIXEL. The function "accept_hits()" applies the same 
+#  acceptance rules to hits on many pixels at once. Each hit in the pulse is either accepted or
 #  rejected and then, based on the operation mode (ToA & ToT mode or ToA Only; superpixel 
 #  VCO enabled in either case), appropriate pixel counter values for each of the hits in
 #  the sequence are returned. The key function for this is "discr_to_data()".
@@ -104,6 +105,93 @@ def accept_or_reject(discr, op_mode=0):
     return discr
 
 
+# array version of "accept_or_reject()" for hits on any number of pixels:
+#        (returns boolean array, True for accepted hits)
+#
+#        ARGUMENTS:   - addr: pixel address of each hit
+#                     - start, stop: start and end time of each hit
+#                     - pixels: state of all pixels carried over from earlier hits (see "pixel_state()"), 
+#                               updated in place; by default all pixels start without previous hit
+#
+#        Hits are processed in order of start time on each pixel. The n-th hits of all pixels 
+#        are tested at once (batched over pixels), so the number of (vectorised) steps is the 
+#        largest number of hits on a single pixel rather than the total number of hits.
+
+def accept_hits(addr, start, stop, op_mode=0, clk_speed=40e6, pixels=None):
+    
+    addr=np.asarray(addr, dtype=np.int64)
+    start=np.asarray(start, dtype=np.float64)
+    stop=np.asarray(stop, dtype=np.float64)
+    accepted=np.zeros(len(addr), dtype=bool)
+    
+    if len(addr)==0:
+        return accepted
+    
+    # sort hits by pixel and start time (unless already in that order); rank of each hit on its pixel
+    steps=np.diff(addr)
+    if (steps >= 0).all() & ((steps > 0) | (np.diff(start) >= 0)).all():
+        order=np.arange(len(addr))
+    else:
+        order=np.lexsort((start, addr))
+    addr_s=addr[order]
+    first=np.flatnonzero(np.diff(addr_s, prepend=addr_s[0]-1))
+    pixel=np.repeat(np.arange(len(first)), np.diff(np.append(first, len(addr_s))))
+    rank=np.arange(len(addr_s)) - first[pixel]
+    
+    start, stop = start[order], stop[order]
+    
+    # decoded ToT of each hit (number of rising clock edges, with overflow at 1022)
+    res=1/clk_speed
+    tot=np.clip(stop // res - start // res, 0, 1022)
+    
+    # state of each pixel: end time and ToT of the previous accepted hit
+    if pixels is None:
+        prev_pulse=np.zeros(len(first))
+        prev_tot=np.zeros(len(first))
+    else:
+        prev_pulse=pixels[0][addr_s[first]]
+        prev_tot=pixels[1][addr_s[first]]
+    
+    # hits of each rank, grouped (hits with the same rank are on different pixels)
+    by_rank=np.argsort(rank, kind='stable')
+    bounds=np.searchsorted(rank[by_rank], np.arange(rank.max()+2))
+    
+    for r in np.arange(rank.max()+1):
+        
+        i=by_rank[bounds[r]:bounds[r+1]]
+        p=pixel[i]
+        
+        # minimum pulse width (ToT >= 1) 
+        ok=tot[i] >= 1
+        
+        # pixel dead time after the previous accepted hit (see "dead_time()")
+        if op_mode==0:
+            deadtime=(19 + prev_tot[p]) / clk_speed
+        else:
+            deadtime=19 / clk_speed
+        ok &= ~((start[i] - prev_pulse[p] < deadtime) & (prev_pulse[p] != 0))
+        
+        # update pixel state for accepted hits
+        prev_pulse[p[ok]]=stop[i[ok]]
+        prev_tot[p[ok]]=tot[i[ok]]
+        accepted[order[i[ok]]]=True
+    
+    # carry state of the pixels over to the next call
+    if pixels is not None:
+        pixels[0][addr_s[first]]=prev_pulse
+        pixels[1][addr_s[first]]=prev_tot
+        
+    return accepted
+
+
+# state of all 2**16 pixels (indexed by address) for "accept_hits()": end time and decoded ToT 
+# of the previous accepted hit (0: no previous hit)
+
+def pixel_state():
+    
+    return np.zeros(2**16), np.zeros(2**16)
+
+
 # read in discriminator data and pixel address and return encoded pixel counter values for each 
 # accepted hit:
 
@@ -11,12 +11,19 @@
 #
 #  This file provides functions, most importantly "raw_to_file()", to convert raw input data to 
 #  to 48-bit packets and write them to a binary output file. The input data must be passed as a 
-#  Pandas DataFrame with columns 'x', 'y', 'start', 'stop' containing the pixel coordinates and hit 
-#  timing data.  
+#  structured array of "raw_dtype" (or a Pandas DataFrame) with columns 'x', 'y', 'start', 'stop' 
+#  containing the pixel coordinates and hit timing data.  
+#
+#
+#  Hit data is kept in compact types throughout: raw input hits in "raw_dtype", processed hits in 
+#  "hit_dtype" (8-bit pixel coordinates, 16-bit address and counters, 64-bit global time in fToA
+#  clock ticks) and decoded columns in the types given by "column_dtypes".
 #  
 #
 #  The function "file_to_df()" allows the reading of output files and to reconstruct hit timing data
-#  as well as pixel counter values from the bit packets (can be saved to file). 
+#  as well as pixel counter values from the bit packets (can be saved to file). Packets are read 
+#  from file through a memory map ("memmap_packets()"), so that large files can be processed
+#  in whole-array operations without reading them into memory first.
 #
 #
 #  This file requires the modules numpy, warnings, and pandas as well as functions from "counters.py", 
@@ -32,132 +39,155 @@ import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)   # surpress FutureWarnings
 import pandas as pd
 from os.path import getsize
-from time_conversion import tot_and_toa_to_time, ftoa_and_toa_to_time
-from counters import counter_decode
-from hits import discr_to_data
+from time_conversion import tot_and_toa_to_time_array, time_to_values_array, unwrap_toa
+from counters import counter_decode_array
+from hits import accept_hits
+from calibration import apply_calibration
 
 
 # convert x,y coordinates of pixel to address:
-#     (see Section 3.3 of the Manual)
+#     (see Section 3.3 of the Manual; works for integers and integer numpy arrays)
 def xy_to_addr(x,y):
     
-    eoc         = int(x/2)
-    supr        = int(y/4)
+    eoc         = x//2
+    supr        = y//4
     pix         = (y%4)+(4*(x%2))                    
     addr        = (eoc<<9) + (supr<<3) + pix 
     
     return addr
 
 # convert pixel address to x,y coordinates:
-#     (see Section 3.3 of the Manual)
+#     (see Section 3.3 of the Manual; works for integers and integer numpy arrays)
 def addr_to_xy(addr):
     
     pix         = addr      & 0b111                  
     supr        = (addr>>3) & 0b111111
     eoc         = (addr>>9) & 0b1111111
-    x           = 2*eoc  + int(pix/4)                 
+    x           = 2*eoc  + pix//4                 
     y           = 4*supr + pix - 4*(x%2)
     
     return x,y
 
 
-# take data frame with raw input (hit timing & pixel coordinate data) and convert to encoded pixel counter values
-# for each hit: 
-#     (works for op_mode=00/01)
+# compact record types shared by simulation, packing and decoding:
+#
+#     - raw_dtype: raw input hits (pixel coordinates and discriminator start and stop times in 
+#                  seconds, see "gen_hits()" in "generate.py")
+#     - hit_dtype: processed hits with pixel coordinates and address, ENCODED pixel counter values
+#                  (ToT is 0 in ToA Only Mode) and the global start time of the hit in fToA clock 
+#                  ticks (1.5625 ns) since the start of the acquisition, i.e. 16*ToA - fToA 
+#                  with the ToA unwrapped over the range of the counter
+
+raw_dtype=np.dtype([('x', np.uint8), ('y', np.uint8), ('start', np.float64), ('stop', np.float64)])
+
+hit_dtype=np.dtype([('x', np.uint8), ('y', np.uint8), ('addr', np.uint16), ('toa', np.uint16), 
+                    ('tot', np.uint16), ('ftoa', np.uint8), ('time', np.int64)])
+
+# compact column types of decoded data
+column_dtypes={'addr': np.uint16, 'x': np.uint8, 'y': np.uint8, 'toa': np.uint16, 'tot': np.uint16, 'ftoa': np.uint8}
 
-def raw_to_unpacked(in_df, op_mode=0):
+
+# combine columns of raw input hits into a structured array (dtype "raw_dtype"), sorted by start time
+
+def raw_hits(x, y, start, stop):
     
-    # replace x,y columns with address data:
-    x=in_df['x']
-    y=in_df['y']
-    addr=np.arange(len(x))
+    start=np.asarray(start, dtype=np.float64)
     
-    for i in addr:
-        addr[i]=xy_to_addr(x.iloc[i], y.iloc[i])
+    hits=np.empty(len(start), dtype=raw_dtype)
+    hits['x'], hits['y'], hits['start'], hits['stop'] = x, y, start, stop
     
-    in_df['addr']=addr
+    # sort only if the hits are not in time order
+    if (np.diff(start) < 0).any():
+        hits=hits[np.argsort(start)]
     
-    in_df=in_df.drop(columns=['x', 'y'])
+    return hits
+
+
+# take raw input (hit timing & pixel coordinate data) and convert to encoded pixel counter values
+# for each hit: 
+#     (works for op_mode=00/01; input can be a structured array of "raw_dtype" or a DataFrame with 
+#      columns 'x', 'y', 'start', 'stop'; returns structured array of "hit_dtype" sorted by time;
+#      "pixels": state of the pixels carried over from earlier hits, see "accept_hits()" in "hits.py")
+
+def raw_to_unpacked(in_df, op_mode=0, pixels=None):
     
-    # create empty output array
-    if op_mode==0:
-        out_df=pd.DataFrame(columns=['addr', 'toa', 'tot', 'ftoa'])
-    elif op_mode==1:
-        out_df=pd.DataFrame(columns=['addr', 'toa', 'dummy', 'ftoa'])
+    x=np.asarray(in_df['x'], dtype=np.int64)
+    y=np.asarray(in_df['y'], dtype=np.int64)
+    start=np.asarray(in_df['start'], dtype=np.float64)
+    stop=np.asarray(in_df['stop'], dtype=np.float64)
     
-    # split input into discr for each pixel
-    addr=in_df['addr']
+    # pixel address of each hit
+    addr=xy_to_addr(x, y)
     
-    for i in np.unique(addr):
-            
-        hits=in_df[in_df.addr == i]
-        
-        start=hits['start']
-        stop=hits['stop']
-         
-        discr=np.arange(2*len(start), dtype=float)
-        
-        for j in np.arange(len(start)):
-            discr[2*j]= start.iloc[j]
-            discr[2*j+1]=stop.iloc[j]
-         
-        # convert discr to counter values for each pixel:
-        df=discr_to_data(discr,i, op_mode)
-        out_df=out_df.append(df,ignore_index=True)
-        
-    # sort resulting data frame by decoded ToA:
-    toa=out_df['toa']
-    toa_decoded=np.arange(len(toa))
+    # accept or reject hits on each pixel (see "hits.py")
+    accepted=accept_hits(addr, start, stop, op_mode, pixels=pixels)
     
-    for i in toa_decoded:
-        toa_decoded[i]=counter_decode(toa.iloc[i],'toa')
+    # compute counter values for accepted hits
+    toa, tot, ftoa, toa_ticks, ftoa_ticks = time_to_values_array(start[accepted], stop[accepted], op_mode)
     
-    out_df['toa_raw']=toa_decoded
-    out_df.sort_values(by=['toa_raw'])
-    out_df=out_df.drop(columns=['toa_raw'])
+    out=np.empty(len(toa), dtype=hit_dtype)
+    out['x'], out['y'], out['addr'] = x[accepted], y[accepted], addr[accepted]
+    out['toa']=toa
+    out['tot']=tot
+    out['ftoa']=ftoa
+    out['time']=16*toa_ticks - ftoa_ticks
     
-    # return output data frame
-    return out_df 
+    # sort by time of the hits
+    return out[np.argsort(out['time'], kind='stable')]
 
 
-# take data frame containing encoded pixel counter values (and addresses) and write packets to binary output file:
+# combine encoded pixel counter values (and addresses) to 48-bit packets:
+#     (input: structured array of "hit_dtype" or DataFrame with columns 'addr', 'toa', 'tot'/'dummy', 'ftoa')
 
-def values_to_file(df,file, op_mode=0):
+def values_to_packets(df, op_mode=0):
     
     # define header
     header=0b1010
     
-    # get columns of data frame:
-    addr=df['addr']
-    toa=df['toa']
-    ftoa=df['ftoa']
+    # get columns:
+    addr=np.asarray(df['addr'], dtype=np.int64)
+    toa=np.asarray(df['toa'], dtype=np.int64)
+    ftoa=np.asarray(df['ftoa'], dtype=np.int64)
 
     if op_mode==0:
-        tot=df['tot']
+        tot=np.asarray(df['tot'], dtype=np.int64)
     elif op_mode==1:
-        dummy=df['dummy']
+        names=df.dtype.names if isinstance(df, np.ndarray) else df.columns
+        tot=np.asarray(df['dummy'], dtype=np.int64) if 'dummy' in names else np.zeros(len(toa), dtype=np.int64)
     
     # define bit masks for packing:
-    ftoaM, totM, toaM, dummy10bM, addrM, headerM     = 0b1111, 0b1111111111, 0b11111111111111,0b1111111111,0b1111111111111111,0b1111 
+    ftoaM, totM, toaM, addrM, headerM     = 0b1111, 0b1111111111, 0b11111111111111,0b1111111111111111,0b1111 
     
-    # loop through rows of data frame and create packets using the bit masks:
-    packets=np.arange(len(toa))
-    for i in packets:
-        if op_mode==0:
-            packets[i]=((header&headerM)<<44)+((addr.iloc[i]&addrM)<<28)+((toa.iloc[i]&toaM)<<14)+((tot.iloc[i]&totM)<<4)+(ftoa.iloc[i]&ftoaM)
-        elif op_mode==1:
-            packets[i]=((header&headerM)<<44)+((addr.iloc[i]&addrM)<<28)+((toa.iloc[i]&toaM)<<14)+((dummy.iloc[i]&dummy10bM)<<4)+(ftoa.iloc[i]&ftoaM)
-            
-    # open stream to file (truncate first)
-    dfile = open(file,'wb')
+    # create packets using the bit masks:
+    packets=((header&headerM)<<44) | ((addr&addrM)<<28) | ((toa&toaM)<<14) | ((tot&totM)<<4) | (ftoa&ftoaM)
+    
+    return packets
 
-    # write each packet to file
-    for i in np.arange(len(packets)):
-        packet=int(packets[i])          
-        dfile.write(packet.to_bytes(6,'big'))
+
+# split 48-bit packets into their (big-endian) bytes:
+#     (returns (n,6) array of bytes, as stored in the binary output files)
+
+def packets_to_bytes(packets):
+    
+    packets=np.asarray(packets, dtype=np.int64)
+    
+    data=np.empty((len(packets), 6), dtype=np.uint8)
+    for i in np.arange(6):
+        data[:,i]=(packets >> (8*(5-i))) & 0b11111111
     
-    # close stream
-    dfile.close()
+    return data
+
+
+# take encoded pixel counter values (and addresses) and write packets to binary output file:
+#     (input: see "values_to_packets()"; append=True: add packets to the end of an existing file)
+
+def values_to_file(df,file, op_mode=0, append=False):
+    
+    packets=values_to_packets(df, op_mode)
+    
+    # write all packets to file at once (truncate first, unless appending)
+    with open(file,'ab' if append else 'wb') as dfile:
+        dfile.write(packets_to_bytes(packets).tobytes())
     
     return 0 
 
@@ -181,7 +211,7 @@ def unpack_001(packet):
 
 def unpack_011(packet): 
     
-    ftoaM, totM, toaM, dummy10bM, addrM, headerM     = 0b1111, 0b11111111111111,0b1111111111,0b1111111111111111,0b1111
+    ftoaM, dummy10bM, toaM, addrM, headerM     = 0b1111, 0b1111111111, 0b11111111111111,0b1111111111111111,0b1111
     
     ftoa      = (packet        ) & ftoaM
     dummy10b  = (packet >>   4 ) & dummy10bM
@@ -192,32 +222,96 @@ def unpack_011(packet):
     return header,addr,toa,dummy10b,ftoa
 
 
-# read list of packets from binary output file:
-#    (returns array of bit packets)
+# map binary output file into memory without reading it:
+#    (returns (n,6) array of raw packet bytes; "offset" and "count" select a range of packets,
+#     count=-1 maps all remaining whole packets, trailing bytes of an incomplete packet are ignored)
 
-def file_to_packets(filename):
+def memmap_packets(filename, offset=0, count=-1):
     
-    # determine number of packets in file
-    n=int(getsize(filename)/6)
+    # determine number of whole packets in file after the offset
+    n=int(getsize(filename)//6) - offset
+    if (count >= 0) & (count < n):
+        n=count
     
-    # create appropriate array to store packets
-    packets=np.arange(n)
+    # np.memmap can not map empty ranges
+    if n <= 0:
+        return np.empty((0,6), dtype=np.uint8)
     
-    # open stream to file
-    dfile = open(filename,'rb')
+    return np.memmap(filename, dtype=np.uint8, mode='r', offset=6*offset, shape=(n,6))
 
-    # read in each packet:
-    for i in np.arange(n):
-        data   = np.fromfile(dfile,dtype=np.byte, count=6)
-        packet = int.from_bytes(data,'big')
-        packets[i]=packet
+
+# combine raw (big-endian) packet bytes into 48-bit packets:
+#    (input: (n,6) array of bytes or flat byte array with a length that is a multiple of 6)
+
+def bytes_to_packets(data):
+    
+    data=np.asarray(data, dtype=np.uint8).reshape(-1,6)
+    
+    packets=np.zeros(len(data), dtype=np.int64)
+    for i in np.arange(6):
+        packets= (packets << 8) | data[:,i]
     
-    # close stream
-    dfile.close()
-   
     return packets
 
 
+# convert pixel mask (65,536 entries indexed by x + 256*y, as returned by "equalise()" in 
+# "equalisation.py"; 1: enabled/not masked, 0: disabled/masked) to a look-up table indexed 
+# by pixel address:
+#    ("mask" can also be a 256 x 256 array indexed [y, x] or the name of a ".npy" file)
+
+def mask_to_addr(mask):
+    
+    if isinstance(mask, str):
+        mask=np.load(mask)
+    mask=np.asarray(mask).reshape(-1) != 0
+    
+    x,y = addr_to_xy(np.arange(2**16))
+    
+    return mask[x + 256*y]
+
+
+# drop packets of masked pixels:
+#    ("mask": pixel mask, see "mask_to_addr()"; "addr_mask": look-up table indexed by pixel address
+#     as returned by "mask_to_addr()", for callers which convert the mask once and re-use it;
+#     if neither is given all packets are kept)
+
+def mask_packets(packets, mask=None, addr_mask=None):
+    
+    if addr_mask is None:
+        if mask is None:
+            return packets
+        addr_mask=mask_to_addr(mask)
+    
+    return packets[addr_mask[(packets >> 28) & 0b1111111111111111]]
+
+
+# read list of packets from binary output file:
+#    (returns array of bit packets)
+
+def file_to_packets(filename, offset=0, count=-1):
+    
+    return bytes_to_packets(memmap_packets(filename, offset, count))
+
+
+# convert columns of decoded data (see "packets_to_columns()") to a data frame sorted by start time
+#     (binary=1: display counters in binary)
+
+def columns_to_df(columns, binary=0):
+    
+    df=pd.DataFrame({name: value for name, value in columns.items() if name != 'addr'})
+    
+    if binary:
+        for name in ['toa', 'tot', 'ftoa']:
+            if name in df:
+                df[name]=[bin(int(value)) for value in df[name]]
+    
+    # sort by start time:
+    if 'start' in df:
+        df=df.sort_values(by=['start'], kind='stable', ignore_index=True)
+    
+    return df
+
+
 # convert a series of bit packets to a data frame containing the pixel counter and timing values
 # for ToA & ToT Mode (op_mode=00):
 # 
@@ -227,69 +321,7 @@ def file_to_packets(filename):
 
 def packets_to_df_001(packets, decode=1, time_data=1, binary=0):
 
-    # to provide start and stop time for each pulse:
-    if time_data==1:
-        
-        # create data frame
-        df=pd.DataFrame(columns=['x', 'y','start', 'stop', 'toa', 'tot', 'ftoa' ])
-        
-        # loop through bit packets
-        for i in np.arange(len(packets)):
-            
-            # unpack each packet
-            header,addr,toa,tot,ftoa = unpack_001(packets[i])
-            x,y = addr_to_xy(addr)
-            start, stop= tot_and_toa_to_time(tot, toa, ftoa)
-            
-            # if wanted, decode
-            if decode:
-                toa=counter_decode(toa, 'toa')
-                tot=counter_decode(tot, 'tot')
-                ftoa=counter_decode(ftoa, 'ftoa')
-            
-            # add to data frame (if wanted, in binary)
-            row={'x': int(x), 'y': int(y), 'start': start, 'stop': stop, 'toa': int(toa), 'tot': int(tot), 'ftoa': int(ftoa)}
-                    
-            if binary:
-                row={'x': int(x), 'y': int(y), 'start': start, 'stop': stop, 'toa': bin(int(toa)), 'tot': bin(int(tot)), 'ftoa': bin(int(ftoa))}
-            
-            df=df.append(row, ignore_index=True)
-    
-    # if pulse timing data is not required:
-    elif time_data==0:
-        
-        # create data frame
-        df=pd.DataFrame(columns=['x', 'y', 'toa', 'tot', 'ftoa' ])
-        
-        # loop through bit packets
-        for i in np.arange(len(packets)):
-            
-            # unpack each packet
-            header,addr,toa,tot,ftoa = unpack_001(packets[i])
-            x,y = addr_to_xy(addr)
-            
-            # if wanted, decode
-            if decode:
-                toa=counter_decode(toa, 'toa')
-                tot=counter_decode(tot, 'tot')
-                ftoa=counter_decode(ftoa, 'ftoa')
-            
-            # add to data frame (if wanted, in binary)
-            row={ 'x': int(x), 'y': int(y),'toa': int(toa), 'tot': int(tot), 'ftoa': int(ftoa)}
-                    
-            if binary:
-                row={ 'x': int(x), 'y': int(y),  'toa': bin(int(toa)), 'tot': bin(int(tot)), 'ftoa': bin(int(ftoa))}
-            
-            df=df.append(row, ignore_index=True)
-
-    # ensure correct data types:
-    if binary==0:    
-        df=df.astype( {'x': 'int64', 'y': 'int64', 'toa': 'int64', 'tot': 'int64', 'ftoa': 'int64'})       
-    
-    # sort by start time:
-    df=df.sort_values(by=['start'], ignore_index=True)
-    
-    return df
+    return columns_to_df(packets_to_columns(packets, 0, decode, time_data), binary)
 
 
 # convert a series of bit packets to a data frame containing the pixel counter and timing values
@@ -301,67 +333,112 @@ def packets_to_df_001(packets, decode=1, time_data=1, binary=0):
 
 def packets_to_df_011(packets, decode=1, time_data=1, binary=0):
 
-    # to provide start time for each pulse:
+    return columns_to_df(packets_to_columns(packets, 1, decode, time_data), binary)
+
+
+# convert a series of bit packets to columns (numpy arrays) of pixel counter and timing values,
+# using whole-array operations:
+#
+# ARGUMENTS:      - op_mode=0/1: ToA & ToT Mode (=0) or ToA Only Mode (=1)
+#                 - decode=0/1 : decoded (=1) or encoded (=0) pixel counters
+#                 - time_data=0/1:  do (=1) or do not (=0) compute hit start (and stop) time 
+#
+# RETURNS:        - dictionary with the same columns as "packets_to_df_001()"/"packets_to_df_011()"
+#                   plus the pixel address 'addr' (packets are not sorted)
+
+def packets_to_columns(packets, op_mode=0, decode=1, time_data=1):
+    
+    # unpack all packets at once
+    if op_mode==0:
+        header,addr,toa,tot,ftoa = unpack_001(packets)
+    elif op_mode==1:
+        header,addr,toa,tot,ftoa = unpack_011(packets)
+    
+    x,y = addr_to_xy(addr)
+    columns={'addr': addr, 'x': x, 'y': y}
+    
     if time_data==1:
+        start, stop= tot_and_toa_to_time_array(tot, toa, ftoa)
+        columns['start']=start
+        if op_mode==0:
+            columns['stop']=stop
+    
+    # if wanted, decode
+    if decode:
+        toa=counter_decode_array(toa, 'toa')
+        tot=counter_decode_array(tot, 'tot')
+        ftoa=counter_decode_array(ftoa, 'ftoa')
+    
+    columns['toa']=toa
+    if op_mode==0:
+        columns['tot']=tot
+    columns['ftoa']=ftoa
+    
+    # use compact data types (see "column_dtypes")
+    for name in column_dtypes:
+        if name in columns:
+            columns[name]=columns[name].astype(column_dtypes[name])
+    
+    return columns
+
+
+# continuous hit start times for a series of bit packets, with the ToA unwrapped over the range 
+# of the counter:
+#    (returns times and the state to be passed on with the next series of packets, see "unwrap_toa()")
+
+def packets_to_time(packets, state=(-1,0)):
+    
+    header,addr,toa,tot,ftoa = unpack_001(packets)
+    ticks, state=unwrap_toa(counter_decode_array(toa, 'toa'), state)
+    
+    return ticks / 40e6 - counter_decode_array(ftoa, 'ftoa') / 640e6, state
+
+
+# convert a series of bit packets to a structured array of "hit_dtype":
+#    (returns hits and the ToA unwrapping state to be passed on with the next series of packets)
+
+def packets_to_hits(packets, op_mode=0, state=(-1,0)):
+    
+    header,addr,toa,tot,ftoa = unpack_001(packets)
+    ticks, state=unwrap_toa(counter_decode_array(toa, 'toa'), state)
+    
+    hits=np.empty(len(packets), dtype=hit_dtype)
+    hits['x'], hits['y'] = addr_to_xy(addr)
+    hits['addr'], hits['toa'], hits['ftoa'] = addr, toa, ftoa
+    hits['tot']=tot if op_mode==0 else 0
+    hits['time']=16*ticks - counter_decode_array(ftoa, 'ftoa')
+    
+    return hits, state
+
+
+# read packets from output file in chunks and return the columns of each chunk (see "packets_to_columns()"):
+#    (generator; only "chunk_size" packets are held in memory at a time)
+#
+#    The column 'time' holds the hit start time since the start of the file, with the ToA unwrapped
+#    over the 0.4096 ms range of the counter (see "unwrap_toa()" in "time_conversion.py").
+#    If calibration parameters "calib" are given (see "calibration.py"), energy and time-walk corrected
+#    times are added (ToA & ToT Mode only). Packets of pixels disabled in "mask" (see "mask_to_addr()")
+#    are dropped before decoding.
+
+def file_to_chunks(file, op_mode=0, decode=1, time_data=1, chunk_size=2**20, calib=None, mask=None):
+    
+    state=(-1,0)
+    n=int(getsize(file)//6)
+    
+    addr_mask=None if mask is None else mask_to_addr(mask)
+    
+    for offset in np.arange(0, n, chunk_size):
         
-        # create data frame
-        df=pd.DataFrame(columns=['x', 'y','start', 'toa', 'ftoa' ])
+        packets=mask_packets(file_to_packets(file, offset, chunk_size), addr_mask=addr_mask)
+        columns=packets_to_columns(packets, op_mode, decode, time_data)
         
-        # loop through bit packets
-        for i in np.arange(len(packets)):
-            
-            # unpack each packet
-            header,addr,toa,dummy10b,ftoa = unpack_011(packets[i])
-            x,y   = addr_to_xy(addr)
-            start = ftoa_and_toa_to_time(toa=toa, ftoa=ftoa)
-            
-            # if wanted, decode
-            if decode:
-                toa=counter_decode(toa, 'toa')
-                ftoa=counter_decode(ftoa, 'ftoa')
-            
-            # add to data frame (if wanted, in binary)
-            row={'x': int(x), 'y': int(y), 'start': start, 'toa': int(toa), 'ftoa': int(ftoa)}
-                    
-            if binary:
-                row={'x': int(x), 'y': int(y), 'start': start,  'toa': bin(int(toa)), 'ftoa': bin(int(ftoa))}
-            
-            df=df.append(row, ignore_index=True)
-    
-    # if pulse timing data is not required:
-    elif time_data==0:
+        if time_data==1:
+            columns['time'], state=packets_to_time(packets, state)
         
-        # create data frame
-        df=pd.DataFrame(columns=['x', 'y', 'toa', 'tot', 'ftoa' ])
+        if (calib is not None) & (op_mode==0):
+            columns=apply_calibration(columns, calib, decode)
         
-        # loop through bit packets
-        for i in np.arange(len(packets)):
-            
-            # unpack each packet
-            header,addr,toa,dummy10b,ftoa = unpack_011(packets[i])
-            x,y = addr_to_xy(addr)
-            
-            # if wanted, decode
-            if decode:
-                toa=counter_decode(toa, 'toa')
-                ftoa=counter_decode(ftoa, 'ftoa')
-            
-            # add to data frame (if wanted, in binary)
-            row={ 'x': int(x), 'y': int(y),'toa': int(toa), 'ftoa': int(ftoa)}
-                    
-            if binary:
-                row={ 'x': int(x), 'y': int(y),  'toa': bin(int(toa)), 'ftoa': bin(int(ftoa))}
-            
-            df=df.append(row, ignore_index=True)
-
-    # ensure correct data types:
-    if binary==0:    
-        df=df.astype( {'x': 'int64', 'y': 'int64', 'toa': 'int64',  'ftoa': 'int64'})        
-    
-    # sort by start time:
-    df=df.sort_values(by=['start'], ignore_index=True)
-    
-    return df    
+        yield columns
 
 
 # read packets from output file and return a data frame containing the pixel counter and timing values
@@ -371,9 +448,9 @@ def packets_to_df_011(packets, decode=1, time_data=1, binary=0):
 #                 - time_data=0/1:  do (=1) or do not (=0) display hit start and stop time  
 #                 - binary=0/1: display counters in binary (=1) or decimal (=0)
 
-def file_to_df_001(file, decode=1, time_data=1, binary=0):
+def file_to_df_001(file, decode=1, time_data=1, binary=0, mask=None):
     
-    packets=file_to_packets(file)
+    packets=mask_packets(file_to_packets(file), mask)
     
     df=packets_to_df_001(packets, decode, time_data, binary)
     
@@ -387,9 +464,9 @@ def file_to_df_001(file, decode=1, time_data=1, binary=0):
 #                 - time_data=0/1:  do (=1) or do not (=0) display hit start time  
 #                 - binary=0/1: display counters in binary (=1) or decimal (=0)
 
-def file_to_df_011(file, decode=1, time_data=1, binary=0):
+def file_to_df_011(file, decode=1, time_data=1, binary=0, mask=None):
     
-    packets=file_to_packets(file)
+    packets=mask_packets(file_to_packets(file), mask)
     
     df=packets_to_df_011(packets, decode, time_data, binary)
     
@@ -400,13 +477,14 @@ def file_to_df_011(file, decode=1, time_data=1, binary=0):
 
 # take data frame with raw input (x,y coordinate of each hit; start, stop time of each hit) and write bit packets  to file:
 #    ( - works for op_mode=00/01
-#      - input_df must have columns 'x', 'y', 'start', 'stop')
+#      - input_df must have columns 'x', 'y', 'start', 'stop'
+#      - pixels, append: see "raw_to_unpacked()" and "values_to_file()")
 
-def raw_to_file(file, in_df, op_mode=0):
+def raw_to_file(file, in_df, op_mode=0, pixels=None, append=False):
 
-    df=raw_to_unpacked(in_df, op_mode)
+    df=raw_to_unpacked(in_df, op_mode, pixels)
     
-    values_to_file(df,file, op_mode)
+    values_to_file(df,file, op_mode, append)
 
     return 0
 
@@ -418,13 +496,20 @@ def raw_to_file(file, in_df, op_mode=0):
 #                 - time_data=0/1:  do (=1) or do not (=0) display hit start and stop time  
 #                 - binary=0/1: display counters in binary (=1) or decimal (=0)
 #                 - save=0/1: save DataFrame as ".csv" file
+#                 - calib: calibration parameters (see "calibration.py"); if given, columns with the
+#                          energy and time-walk corrected start time are added (ToA & ToT Mode only)
+#                 - mask: pixel mask (see "mask_to_addr()"); hits on disabled pixels are dropped 
+#                         before decoding
 
-def file_to_df(file, op_mode=0, decode=1, time_data=1, binary=0, save=0, name=' '):
+def file_to_df(file, op_mode=0, decode=1, time_data=1, binary=0, save=0, name=' ', calib=None, mask=None):
     
     if op_mode==0:
-        df=file_to_df_001(file, decode, time_data, binary)
+        df=file_to_df_001(file, decode, time_data, binary, mask)
     elif op_mode==1:
-        df=file_to_df_011(file, decode, time_data, binary)
+        df=file_to_df_011(file, decode, time_data, binary, mask)
+    
+    if (calib is not None) & (op_mode==0) & (binary==0):
+        df=apply_calibration(df, calib, decode)
     
     if save:
         df.to_csv(name)
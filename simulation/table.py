@@ -0,0 +1,145 @@
+#  ------------------------------------------------------------------------------------------
+#  "table.py" - Contains a light-weight columnar container for decoded hit data
+#  ------------------------------------------------------------------------------------------
+#
+#  "file_to_df()" in "packing.py" always computes every column of the decoded data and returns
+#  a pandas DataFrame, even if only two of them are needed. The class "HitTable" instead holds
+#  only the raw (encoded) fields of the packets: address, ToA, ToT (or the 10-bit dummy in ToA
+#  Only Mode) and fToA. All other columns are computed when they are first accessed and then
+#  kept:
+#         - 'x', 'y': pixel coordinates
+#         - 'start', 'stop': hit start and end times (ToA & ToT Mode for 'stop')
+#         - 'time': hit start time with the ToA unwrapped over the range of the counter
+#         - 'toa', 'tot', 'ftoa': decoded pixel counters
+#  e.g.
+#        >>> hits=file_to_table('packets.bin')
+#        >>> hits.x, hits.y              # only the address is decoded
+#
+#
+#  Slicing a HitTable (hits[a:b], hits[mask], hits[indices]) returns a new HitTable; for slices
+#  the raw fields and any columns already computed are views of the original arrays (no copy).
+#  The column 'time' of a slice is taken from the table it was sliced from, as the unwrapping of
+#  the ToA depends on all earlier hits (hits[a:b].time equals hits.time[a:b]).
+#  "to_pandas()" converts the table to a DataFrame with the same columns as "file_to_df()".
+#
+#
+#  This file requires numpy and pandas as well as functions from "counters.py",
+#  "time_conversion.py" and "packing.py".
+
+
+# import modules
+import numpy as np
+import pandas as pd
+from counters import counter_decode_array
+from time_conversion import tot_and_toa_to_time_array, unwrap_toa
+from packing import file_to_packets, mask_packets, unpack_001, addr_to_xy, column_dtypes
+
+
+class HitTable:
+
+    __slots__=('addr', 'toa_raw', 'tot_raw', 'ftoa_raw', 'op_mode', '_columns', '_origin')
+
+    def __init__(self, addr, toa_raw, tot_raw, ftoa_raw, op_mode=0):
+
+        # raw fields in compact data types (see "column_dtypes" in "packing.py")
+        self.addr=np.asarray(addr).astype(column_dtypes['addr'], copy=False)
+        self.toa_raw=np.asarray(toa_raw).astype(column_dtypes['toa'], copy=False)
+        self.tot_raw=np.asarray(tot_raw).astype(column_dtypes['tot'], copy=False)
+        self.ftoa_raw=np.asarray(ftoa_raw).astype(column_dtypes['ftoa'], copy=False)
+        self.op_mode=op_mode
+        self._columns={}          # columns computed so far
+        self._origin=None         # (table, index) this table was sliced from
+
+    # set up table from a series of bit packets
+    @classmethod
+    def from_packets(cls, packets, op_mode=0):
+
+        header,addr,toa,tot,ftoa = unpack_001(packets)
+
+        return cls(addr, toa, tot, ftoa, op_mode)
+
+    def __len__(self):
+        return len(self.addr)
+
+    def __getitem__(self, index):
+
+        table=HitTable(self.addr[index], self.toa_raw[index], self.tot_raw[index], self.ftoa_raw[index], self.op_mode)
+        table._columns={name: column[index] for name, column in self._columns.items()}
+        if 'time' not in self._columns:
+            table._origin=(self, index)
+
+        return table
+
+    # compute column on first access
+    def column(self, name):
+
+        if name not in self._columns:
+
+            if name in ['x', 'y']:
+                self._columns['x'], self._columns['y'] = addr_to_xy(self.addr)
+            elif name in ['start', 'stop']:
+                self._columns['start'], self._columns['stop'] = tot_and_toa_to_time_array(self.tot_raw, self.toa_raw, self.ftoa_raw)
+            elif (name=='time') & (self._origin is not None):
+                table, index = self._origin
+                self._columns['time']=table.column('time')[index]
+                self._origin=None
+            elif name=='time':
+                ticks, state=unwrap_toa(self.column('toa'))
+                self._columns['time']=ticks / 40e6 - self.column('ftoa') / 640e6
+            elif name in ['toa', 'tot', 'ftoa']:
+                self._columns[name]=counter_decode_array(getattr(self, name + '_raw'), name)
+            else:
+                raise KeyError(name)
+
+            # use compact data types, as "file_to_df()"
+            for key in self._columns:
+                if key in column_dtypes:
+                    self._columns[key]=self._columns[key].astype(column_dtypes[key], copy=False)
+
+        return self._columns[name]
+
+    x=property(lambda self: self.column('x'))
+    y=property(lambda self: self.column('y'))
+    start=property(lambda self: self.column('start'))
+    stop=property(lambda self: self.column('stop'))
+    time=property(lambda self: self.column('time'))
+    toa=property(lambda self: self.column('toa'))
+    tot=property(lambda self: self.column('tot'))
+    ftoa=property(lambda self: self.column('ftoa'))
+
+    # names of the columns of "file_to_df()" for the operation mode of the table
+    def names(self):
+
+        if self.op_mode==0:
+            return ['x', 'y', 'start', 'stop', 'toa', 'tot', 'ftoa']
+
+        return ['x', 'y', 'start', 'toa', 'ftoa']
+
+    # convert to DataFrame:
+    #     - columns: list of columns (default: same as "file_to_df()")
+    #     - decode=0/1: encoded (=0) or decoded (=1) pixel counters
+    #     - sort=True/False: sort by start time, as "file_to_df()"
+    def to_pandas(self, columns=None, decode=1, sort=False):
+
+        if columns is None:
+            columns=self.names()
+
+        data={}
+        for name in columns:
+            if (not decode) & (name in ['toa', 'tot', 'ftoa']):
+                data[name]=getattr(self, name + '_raw').astype(column_dtypes[name])
+            else:
+                data[name]=self.column(name)
+
+        df=pd.DataFrame(data)
+        if sort & ('start' in df):
+            df=df.sort_values(by=['start'], ignore_index=True)
+
+        return df
+
+
+# read packets from output file into a HitTable (see "mask_to_addr()" in "packing.py" for "mask")
+
+def file_to_table(file, op_mode=0, mask=None):
+
+    return HitTable.from_packets(mask_packets(file_to_packets(file), mask), op_mode)
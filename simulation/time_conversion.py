@@ -50,7 +50,7 @@
 # import modules
 
 import numpy as np
-from counters import counter_encode, counter_decode
+from counters import counter_encode, counter_decode, counter_encode_array, counter_decode_array
 
 
 # returns ToA timestamp associated with a point in time:
@@ -161,6 +161,43 @@ def tot_and_toa_to_time(tot, toa, ftoa=0, clk_speed_1=40e6, clk_speed_2=640e6, e
     
     return start, stop
 
+# array version of "tot_and_toa_to_time()": returns start and end times of whole numpy arrays 
+# of hits from their ENCODED ToT, ToA and fToA values
+
+def tot_and_toa_to_time_array(tot, toa, ftoa=0, clk_speed_1=40e6, clk_speed_2=640e6, epoch=0):
+    
+    # get start time of hits from ToA and fToA
+    start= epoch + counter_decode_array(toa, 'toa') / clk_speed_1 - counter_decode_array(ftoa, 'ftoa') / clk_speed_2
+    
+    # get end time of hits from start time and ToT
+    stop= start + counter_decode_array(tot, 'ToT') / clk_speed_1
+    
+    return start, stop
+
+
+# unwrap DECODED ToA values (clock ticks) of consecutive hits into a continuous count of clock
+# ticks since the start of the acquisition:
+#     - the ToA counter wraps around after 2**14 ticks (0.4096 ms, see Comment 3. above); a step
+#       backwards by more than half of that range is taken as a wrap of the counter
+#     - "state" holds the last ToA value and the number of wraps so far, so that the unwrapping
+#       can be continued over consecutive chunks of data (pass the returned state to the next call)
+
+def unwrap_toa(ticks, state=(-1,0), toa_range=2**14):
+    
+    ticks=np.asarray(ticks, dtype=np.int64)
+    prev_ticks, wraps = state
+    
+    if len(ticks)==0:
+        return ticks.copy(), state
+    
+    # count wraps of the counter up to each hit
+    if prev_ticks < 0:
+        prev_ticks=ticks[0]
+    steps=np.diff(ticks, prepend=prev_ticks)
+    n_wraps= wraps + np.cumsum(steps < -toa_range//2)
+    
+    return ticks + n_wraps*toa_range, (int(ticks[-1]), int(n_wraps[-1]))
+
 # # # # # # # # # # # # # # # # # # # # FINALISED FUNCTIONS # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 # convert hit timing information to ToA, ftoA, ToT
@@ -184,4 +221,33 @@ def values_to_time(toa, ftoa, tot):
     
     start, stop =tot_and_toa_to_time(tot, toa, ftoa)
     
-    return start, stop
\ No newline at end of file
+    return start, stop
+
+
+# array version of "time_to_values()": convert start and stop times of whole numpy arrays of hits to
+# ENCODED ToA, ToT and fToA values, plus the number of clock ticks (ToA) and fToA clock ticks of each
+# start time, using the same conventions as "time_to_toa()", "time_to_ftoa()" and "time_to_tot()"
+#   (if op_mode=1 the returned ToT values are 0)
+
+def time_to_values_array(start, stop, op_mode=0, clk_speed_1=40e6, clk_speed_2=640e6, epoch=0):
+    
+    start=np.asarray(start, dtype=np.float64) - epoch
+    stop=np.asarray(stop, dtype=np.float64) - epoch
+    res=1/clk_speed_1
+    
+    # ToA: rising clock edges since epoch
+    last_ticks=start // res
+    toa_ticks=(last_ticks + (start % res != 0)).astype(np.int64)
+    
+    # fToA: rising fToA-clock edges between hit and next system clock edge
+    ftoa_ticks=((res*(last_ticks + 1) - start) // (1/clk_speed_2)).astype(np.int64)
+    
+    # ToT: rising clock edges while the discriminator is up
+    tot_ticks=(stop // res - last_ticks).astype(np.int64)
+    
+    # (the 14-bit ToA counter wraps around every 2**14 ticks)
+    toa=counter_encode_array(toa_ticks % 2**14, 'toa')
+    ftoa=counter_encode_array(ftoa_ticks, 'ftoa')
+    tot=counter_encode_array(tot_ticks, 'tot') if op_mode==0 else np.zeros(len(toa), dtype=np.int64)
+    
+    return toa, tot, ftoa, toa_ticks, ftoa_ticks